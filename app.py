@@ -1,14 +1,14 @@
 import streamlit as st
-#import tensorflow as tf
-#from tensorflow import keras
-from PIL import Image
-import numpy as np
-import requests
-from io import BytesIO
+from streamlit import runtime
 import base64
-import torch
-from transformers import ViTForImageClassification, AutoImageProcessor
-from torchvision import transforms
+import hashlib
+import time
+from imagetruth import get_analyzer, get_image_derivatives, load_url, open_image
+from imagetruth.batching import Overloaded
+from imagetruth.config import (
+    BATCH_JOB_POLL_INTERVAL, HISTORY_THUMB_BYTES, HISTORY_THUMB_SIZE, PREVIEW_MAX_SIZE, RESULT_PREVIEW_BYTES,
+)
+from imagetruth.jobs import get_batch_job, start_batch_job
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # CONFIG
@@ -35,8 +35,11 @@ if "model_type" not in st.session_state:
     st.session_state.model_type = "binary"  # "binary" or "multiclass"
 if "analysis_mode" not in st.session_state:
     st.session_state.analysis_mode = "single"  # "single", "compare", "batch"
-if "batch_results" not in st.session_state:
-    st.session_state.batch_results = []
+if "batch_job_id" not in st.session_state:
+    # Batch jobs keep running when the page is left; the job id in the URL finds one again
+    st.session_state.batch_job_id = st.query_params.get("job")
+    if st.session_state.batch_job_id:
+        st.session_state.analysis_mode = "batch"
 if "compare_images" not in st.session_state:
     st.session_state.compare_images = [None, None]
 if "compare_results" not in st.session_state:
@@ -1150,145 +1153,25 @@ p, span, div, label {{
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # HELPERS
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-IMG_SIZE = (128, 128)
-MODEL_PATH = "models/basic_cnn.keras"
-VIT_IMG_SIZE = 224
-
-# ViT Model configurations
-BINARY_MODEL_NAME = "gechen98/AI_image_classification"
-MULTICLASS_MODEL_NAME = "gechen98/AI_image_generator_classification"
-VIT_BASE_MODEL = "google/vit-base-patch16-224"
-
-# Multiclass labels
-MULTICLASS_LABELS = ['glide', 'midjourney', 'wukong', 'adm', 'sdv5', 'vqdm', 'biggan']
-
 SAMPLES = [
     {"name": "Real Photo", "icon": "📷", "url": "https://images.unsplash.com/photo-1772307956262-42d4f7696876?q=80&w=2070&auto=format&fit=crop&ixlib=rb-4.1.0&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D", "type": "real"},
     {"name": "AI Portrait", "icon": "🤖", "url": "https://raw.githubusercontent.com/Gechen989898/AI_Art_vs_Human_Art/master/ai-image.jpeg", "type": "ai"},
     {"name": "Real Dog", "icon": "🐕", "url": "https://images.unsplash.com/photo-1587300003388-59208cc962cb?w=400", "type": "real"},
 ]
 
-# Device for PyTorch
-DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-
-@st.cache_resource
-def load_model():
-    return keras.models.load_model(MODEL_PATH)
-
-@st.cache_resource
-def load_vit_binary_model():
-    """Load the binary classification ViT model from Hugging Face"""
-    model = ViTForImageClassification.from_pretrained(BINARY_MODEL_NAME)
-    model.to(DEVICE)
-    model.eval()
-    return model
-
-@st.cache_resource
-def load_vit_multiclass_model():
-    """Load the multiclass classification ViT model from Hugging Face"""
-    model = ViTForImageClassification.from_pretrained(MULTICLASS_MODEL_NAME)
-    model.to(DEVICE)
-    model.eval()
-    return model
-
-@st.cache_resource
-def load_vit_processor():
-    """Load the ViT image processor"""
-    return AutoImageProcessor.from_pretrained(VIT_BASE_MODEL)
-
-def get_vit_transforms(processor):
-    """Get transforms for ViT models"""
-    mean = processor.image_mean
-    std = processor.image_std
-    return transforms.Compose([
-        transforms.Resize((VIT_IMG_SIZE, VIT_IMG_SIZE)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=mean, std=std),
-    ])
-
-def preprocess(image):
-    if image.mode != "RGB":
-        image = image.convert("RGB")
-    image = image.resize(IMG_SIZE)
-    return np.array(image).reshape((1, 128, 128, 3)) / 255.0
-
-def preprocess_vit(image, transform):
-    """Preprocess image for ViT model"""
-    if image.mode != "RGB":
-        image = image.convert("RGB")
-    tensor = transform(image).unsqueeze(0).to(DEVICE)
-    return tensor
-
-def predict(model, img_array):
-    pred = model.predict(img_array, verbose=0)
-    score = float(pred[0][0])
-    if score < 0.5:
-        return {"label": "AI Generated", "is_ai": True, "confidence": (1 - score) * 100, "raw": score}
-    return {"label": "Real Image", "is_ai": False, "confidence": score * 100, "raw": score}
-
-def predict_vit_binary(model, image_tensor):
-    """Predict using binary ViT model"""
-    with torch.no_grad():
-        outputs = model(pixel_values=image_tensor)
-        probs = torch.softmax(outputs.logits, dim=1)[0]
-        pred_id = int(probs.argmax().item())
-        confidence = float(probs[pred_id].item()) * 100
-        
-        # id2label: {0: 'ai', 1: 'nature'}
-        is_ai = pred_id == 0
-        label = "AI Generated" if is_ai else "Real Image"
-        
-        return {
-            "label": label,
-            "is_ai": is_ai,
-            "confidence": confidence,
-            "raw": float(probs[0].item()),  # AI probability
-            "probs": probs.cpu().numpy()
-        }
-
-def predict_vit_multiclass(model, image_tensor):
-    """Predict using multiclass ViT model to identify AI generator type"""
-    with torch.no_grad():
-        outputs = model(pixel_values=image_tensor)
-        probs = torch.softmax(outputs.logits, dim=1)[0]
-        pred_id = int(probs.argmax().item())
-        confidence = float(probs[pred_id].item()) * 100
-        
-        # Get label from model config or use our list
-        if hasattr(model.config, 'id2label') and model.config.id2label:
-            pred_label = model.config.id2label[pred_id]
-        else:
-            pred_label = MULTICLASS_LABELS[pred_id]
-        
-        # Build all class probabilities
-        all_probs = {}
-        for i, prob in enumerate(probs.cpu().numpy()):
-            if hasattr(model.config, 'id2label') and model.config.id2label:
-                label = model.config.id2label[i]
-            else:
-                label = MULTICLASS_LABELS[i]
-            all_probs[label] = float(prob) * 100
-        
-        return {
-            "label": pred_label,
-            "is_ai": True,  # All multiclass predictions are AI generators
-            "confidence": confidence,
-            "raw": float(probs[pred_id].item()),
-            "all_probs": all_probs,
-            "pred_id": pred_id
-        }
-
-def load_url(url):
-    resp = requests.get(url, timeout=10)
-    resp.raise_for_status()
-    return Image.open(BytesIO(resp.content))
-
-def img_to_b64(image, max_size=800):
-    img = image.copy().convert("RGB")
-    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-    buf = BytesIO()
-    img.save(buf, format="JPEG", quality=90)
-    return base64.b64encode(buf.getvalue()).decode()
+def media_url(data, mimetype="image/jpeg"):
+    """URL for image bytes served from Streamlit's in-process, content-addressed media store"""
+    if runtime.exists():
+        # Same bytes -> same file id and URL, so browsers cache previews across reruns.
+        # Streamlit drops files a run no longer references, so callers re-add them on every run.
+        digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+        try:
+            # media_file_mgr is internal Streamlit API (unchanged from 1.30 through 1.65, see
+            # requirements.txt); if it moves, previews fall back to inline data URLs below
+            return runtime.get_instance().media_file_mgr.add(data, mimetype, f"imagetruth.media.{digest}")
+        except (AttributeError, TypeError):
+            pass
+    return f"data:{mimetype};base64,{base64.b64encode(data).decode()}"
 
 def get_confidence_interpretation(confidence, is_ai):
     """Return interpretation text and icon based on confidence level"""
@@ -1316,20 +1199,6 @@ def get_confidence_interpretation(confidence, is_ai):
     
     return icon, text
 
-def analyze_image(img, vit_transform, vit_binary_model, vit_multiclass_model):
-    """Analyze an image and return results with generator info if AI"""
-    tensor = preprocess_vit(img, vit_transform)
-    res = predict_vit_binary(vit_binary_model, tensor)
-    
-    # If AI-generated, also identify the generator
-    if res["is_ai"]:
-        multiclass_res = predict_vit_multiclass(vit_multiclass_model, tensor)
-        res["generator"] = multiclass_res["label"]
-        res["generator_confidence"] = multiclass_res["confidence"]
-        res["all_probs"] = multiclass_res["all_probs"]
-    
-    return res
-
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # NAVBAR - Using st.columns for real buttons
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -1358,21 +1227,16 @@ with col5:
 
 st.markdown(f'<hr style="margin: 8px 0 16px; border: none; border-top: 1px solid {border_color};">', unsafe_allow_html=True)
 
-# Load models
-try:
-    model = load_model()  # Legacy CNN model
-except:
-    model = None
-
-# Load ViT models and processor
-try:
-    vit_processor = load_vit_processor()
-    vit_transform = get_vit_transforms(vit_processor)
-    vit_binary_model = load_vit_binary_model()
-    vit_multiclass_model = load_vit_multiclass_model()
-except Exception as e:
-    st.error(f"ViT models failed to load: {e}")
+# ViT models load in the background (or live in a separate inference server); the page
+# renders straight away and anything analyzed before they are ready waits for them
+analyzer = get_analyzer()
+if analyzer.status == "error":
+    st.error(f"ViT models are unavailable: {analyzer.error}")
+    # Starts another load once the retry cooldown has passed; later runs show its progress
+    analyzer.retry()
     st.stop()
+elif not analyzer.ready:
+    st.info("Loading detection models... you can upload now, analysis starts as soon as they are ready.")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # HOME PAGE
@@ -1381,9 +1245,10 @@ if st.session_state.page == "home":
     
     # Show result if we have one
     if st.session_state.analyzed_image and st.session_state.result:
-        img = st.session_state.analyzed_image
+        derivatives = st.session_state.analyzed_image
         res = st.session_state.result
-        b64 = img_to_b64(img)
+        preview_src = media_url(*derivatives.preview(PREVIEW_MAX_SIZE, RESULT_PREVIEW_BYTES))
+        img_width, img_height = derivatives.original_size
         badge_class = "ai" if res["is_ai"] else "real"
         
         # Back button
@@ -1408,7 +1273,7 @@ if st.session_state.page == "home":
             full_html = f"""
             <div class="result-card">
                 <div class="result-image-wrap">
-                    <img src="data:image/jpeg;base64,{b64}" class="result-img"/>
+                    <img src="{preview_src}" class="result-img"/>
                     <div class="result-badge ai">
                         🤖 AI GENERATED
                     </div>
@@ -1434,7 +1299,7 @@ if st.session_state.page == "home":
                             <div class="stat-label">AI Score</div>
                         </div>
                         <div class="stat-box">
-                            <div class="stat-value">{img.size[0]}×{img.size[1]}</div>
+                            <div class="stat-value">{img_width}×{img_height}</div>
                             <div class="stat-label">Dimensions</div>
                         </div>
                         <div class="stat-box">
@@ -1475,7 +1340,7 @@ if st.session_state.page == "home":
             st.markdown(f"""
             <div class="result-card">
                 <div class="result-image-wrap">
-                    <img src="data:image/jpeg;base64,{b64}" class="result-img"/>
+                    <img src="{preview_src}" class="result-img"/>
                     <div class="result-badge {badge_class}">
                         {"🤖" if res["is_ai"] else "📷"} {res["label"]}
                     </div>
@@ -1484,7 +1349,7 @@ if st.session_state.page == "home":
                     <div class="result-header">
                         <div>
                             <div class="result-title">{"AI Generated" if res["is_ai"] else "Real Photograph"}</div>
-                            <div class="result-subtitle">Analysis completed</div>
+                            <div class="result-subtitle">{"Matched a previously analyzed copy of this image" if res.get("cache") == "near-dup" else "Analysis completed"}</div>
                         </div>
                         <div class="confidence-display">
                             <div class="confidence-number">{res["confidence"]:.1f}%</div>
@@ -1500,7 +1365,7 @@ if st.session_state.page == "home":
                             <div class="stat-label">Raw Score</div>
                         </div>
                         <div class="stat-box">
-                            <div class="stat-value">{img.size[0]}×{img.size[1]}</div>
+                            <div class="stat-value">{img_width}×{img_height}</div>
                             <div class="stat-label">Dimensions</div>
                         </div>
                         <div class="stat-box">
@@ -1578,7 +1443,7 @@ if st.session_state.page == "home":
             img_to_analyze = None
             
             if uploaded:
-                img_to_analyze = Image.open(uploaded)
+                img_to_analyze = open_image(uploaded)
             elif url_input:
                 try:
                     img_to_analyze = load_url(url_input)
@@ -1586,34 +1451,38 @@ if st.session_state.page == "home":
                     st.error(f"Failed to load image from URL: {str(e)}")
             
             if img_to_analyze:
+                derivatives = get_image_derivatives(img_to_analyze)
                 # Show image preview with loading overlay
-                preview_b64 = img_to_b64(img_to_analyze)
+                preview_src = media_url(*derivatives.preview(PREVIEW_MAX_SIZE, RESULT_PREVIEW_BYTES))
                 preview_placeholder = st.empty()
                 preview_placeholder.markdown(f'''
                 <div class="preview-card">
                     <div class="preview-image-wrap">
-                        <img src="data:image/jpeg;base64,{preview_b64}" class="preview-img"/>
+                        <img src="{preview_src}" class="preview-img"/>
                         <div class="preview-overlay">
                             <div class="preview-spinner"></div>
-                            <div class="preview-text">Analyzing image...</div>
+                            <div class="preview-text">{"Analyzing image..." if analyzer.ready else "Loading models..."}</div>
                         </div>
                     </div>
                 </div>
                 ''', unsafe_allow_html=True)
                 
                 # Run analysis
-                res = analyze_image(img_to_analyze, vit_transform, vit_binary_model, vit_multiclass_model)
+                try:
+                    res = analyzer.analyze([derivatives])[0]
+                except (Overloaded, RuntimeError) as e:
+                    preview_placeholder.empty()
+                    st.error(f"Analysis failed: {e}")
+                    st.stop()
                 
                 # Clear preview
                 preview_placeholder.empty()
                 
-                st.session_state.analyzed_image = img_to_analyze
+                st.session_state.analyzed_image = derivatives
                 st.session_state.result = res
                 # Add to history
-                thumb = img_to_analyze.copy()
-                thumb.thumbnail((80, 80), Image.Resampling.LANCZOS)
                 st.session_state.history.insert(0, {
-                    "thumb": img_to_b64(thumb, 80),
+                    "thumb": derivatives.preview(HISTORY_THUMB_SIZE, HISTORY_THUMB_BYTES),
                     "label": res["label"],
                     "is_ai": res["is_ai"],
                     "confidence": res["confidence"]
@@ -1636,14 +1505,12 @@ if st.session_state.page == "home":
                     st.markdown('<div class="sample-btn">', unsafe_allow_html=True)
                     if st.button(f"{sample['icon']} {sample['name']}", key=f"sample_{i}", use_container_width=True):
                         try:
-                            img = load_url(sample['url'])
-                            res = analyze_image(img, vit_transform, vit_binary_model, vit_multiclass_model)
-                            st.session_state.analyzed_image = img
+                            derivatives = get_image_derivatives(load_url(sample['url']))
+                            res = analyzer.analyze([derivatives])[0]
+                            st.session_state.analyzed_image = derivatives
                             st.session_state.result = res
-                            thumb = img.copy()
-                            thumb.thumbnail((80, 80), Image.Resampling.LANCZOS)
                             st.session_state.history.insert(0, {
-                                "thumb": img_to_b64(thumb, 80),
+                                "thumb": derivatives.preview(HISTORY_THUMB_SIZE, HISTORY_THUMB_BYTES),
                                 "label": res["label"],
                                 "is_ai": res["is_ai"],
                                 "confidence": res["confidence"]
@@ -1671,24 +1538,27 @@ if st.session_state.page == "home":
                 uploaded2 = st.file_uploader("Upload second image", type=["jpg", "jpeg", "png", "webp"], label_visibility="collapsed", key="compare_2")
             
             if uploaded1 and uploaded2:
-                img1 = Image.open(uploaded1)
-                img2 = Image.open(uploaded2)
+                derivatives1 = get_image_derivatives(open_image(uploaded1))
+                derivatives2 = get_image_derivatives(open_image(uploaded2))
                 
-                with st.spinner("Analyzing both images..."):
-                    res1 = analyze_image(img1, vit_transform, vit_binary_model, vit_multiclass_model)
-                    res2 = analyze_image(img2, vit_transform, vit_binary_model, vit_multiclass_model)
+                try:
+                    with st.spinner("Analyzing both images..."):
+                        res1, res2 = analyzer.analyze([derivatives1, derivatives2])
+                except (Overloaded, RuntimeError) as e:
+                    st.error(f"Analysis failed: {e}")
+                    st.stop()
                 
                 # Display comparison results using Streamlit columns
                 comp_col1, comp_col2 = st.columns(2)
                 
                 with comp_col1:
-                    b64_1 = img_to_b64(img1)
+                    src_1 = media_url(*derivatives1.preview(PREVIEW_MAX_SIZE, RESULT_PREVIEW_BYTES))
                     badge1 = "ai" if res1["is_ai"] else "real"
                     icon1 = "🤖" if res1["is_ai"] else "📷"
                     
                     card_html1 = f'''<div class="compare-card">
                         <div class="compare-image-wrap">
-                            <img src="data:image/jpeg;base64,{b64_1}" class="compare-img"/>
+                            <img src="{src_1}" class="compare-img"/>
                             <div class="compare-badge {badge1}">{icon1} {res1["label"]}</div>
                         </div>
                         <div class="compare-body">
@@ -1703,13 +1573,13 @@ if st.session_state.page == "home":
                     st.markdown(card_html1, unsafe_allow_html=True)
                 
                 with comp_col2:
-                    b64_2 = img_to_b64(img2)
+                    src_2 = media_url(*derivatives2.preview(PREVIEW_MAX_SIZE, RESULT_PREVIEW_BYTES))
                     badge2 = "ai" if res2["is_ai"] else "real"
                     icon2 = "🤖" if res2["is_ai"] else "📷"
                     
                     card_html2 = f'''<div class="compare-card">
                         <div class="compare-image-wrap">
-                            <img src="data:image/jpeg;base64,{b64_2}" class="compare-img"/>
+                            <img src="{src_2}" class="compare-img"/>
                             <div class="compare-badge {badge2}">{icon2} {res2["label"]}</div>
                         </div>
                         <div class="compare-body">
@@ -1738,35 +1608,24 @@ if st.session_state.page == "home":
             
             if uploaded_files:
                 if st.button("🔍 Analyze All", type="primary", use_container_width=True):
-                    batch_results = []
-                    progress_bar = st.progress(0)
-                    
-                    for idx, uploaded in enumerate(uploaded_files):
-                        try:
-                            img = Image.open(uploaded)
-                            res = analyze_image(img, vit_transform, vit_binary_model, vit_multiclass_model)
-                            batch_results.append({
-                                "image": img,
-                                "b64": img_to_b64(img, 300),
-                                "result": res,
-                                "filename": uploaded.name
-                            })
-                        except Exception as e:
-                            batch_results.append({
-                                "image": None,
-                                "b64": None,
-                                "result": {"error": str(e)},
-                                "filename": uploaded.name
-                            })
-                        progress_bar.progress((idx + 1) / len(uploaded_files))
-                    
-                    st.session_state.batch_results = batch_results
-                    progress_bar.empty()
+                    # Analysis runs as a background job; results fill in below as each chunk finishes
+                    job = start_batch_job([(uploaded.name, uploaded.getvalue()) for uploaded in uploaded_files])
+                    st.session_state.batch_job_id = job.id
+                    st.query_params["job"] = job.id
                     st.rerun()
             
             # Show batch results
-            if st.session_state.batch_results:
-                results = st.session_state.batch_results
+            batch_job = get_batch_job(st.session_state.batch_job_id)
+            if st.session_state.batch_job_id and batch_job is None:
+                st.info("This batch job is no longer available. Upload the images again to re-run it.")
+                st.session_state.batch_job_id = None
+                st.query_params.pop("job", None)
+            if batch_job is not None:
+                results = batch_job.results()
+                if batch_job.running:
+                    st.progress(batch_job.done / batch_job.total, text=f"Analyzed {batch_job.done} of {batch_job.total} images")
+                elif batch_job.status == "error":
+                    st.error(f"Batch analysis failed: {batch_job.error}")
                 ai_count = sum(1 for r in results if r["result"].get("is_ai", False))
                 real_count = len(results) - ai_count
                 
@@ -1791,14 +1650,14 @@ if st.session_state.page == "home":
                 # Grid of results
                 cols = st.columns(2)
                 for idx, item in enumerate(results):
-                    if item["b64"] and "error" not in item["result"]:
+                    if item["preview"] and "error" not in item["result"]:
                         res = item["result"]
                         label_class = "ai" if res["is_ai"] else "real"
                         icon = "🤖" if res["is_ai"] else "📷"
                         with cols[idx % 2]:
                             st.markdown(f'''
                             <div class="batch-card">
-                                <img src="data:image/jpeg;base64,{item["b64"]}" class="batch-image"/>
+                                <img src="{media_url(*item["preview"])}" class="batch-image"/>
                                 <div class="batch-body">
                                     <div class="batch-label {label_class}">{icon} {res["label"]}</div>
                                     <div class="batch-conf">{res["confidence"]:.1f}%</div>
@@ -1807,7 +1666,9 @@ if st.session_state.page == "home":
                             ''', unsafe_allow_html=True)
                 
                 if st.button("🗑️ Clear Results", use_container_width=True):
-                    st.session_state.batch_results = []
+                    batch_job.cancel()
+                    st.session_state.batch_job_id = None
+                    st.query_params.pop("job", None)
                     st.rerun()
         
         # History section
@@ -1816,7 +1677,7 @@ if st.session_state.page == "home":
             for item in st.session_state.history:
                 label_class = "ai" if item["is_ai"] else "real"
                 icon = "🤖" if item["is_ai"] else "📷"
-                items_html += f'<div class="history-item"><img src="data:image/jpeg;base64,{item["thumb"]}" class="history-thumb"/><div class="history-info"><div class="history-label {label_class}">{icon} {item["label"]}</div><div class="history-conf">{item["confidence"]:.1f}%</div></div></div>'
+                items_html += f'<div class="history-item"><img src="{media_url(*item["thumb"])}" class="history-thumb"/><div class="history-info"><div class="history-label {label_class}">{icon} {item["label"]}</div><div class="history-conf">{item["confidence"]:.1f}%</div></div></div>'
             
             st.markdown(f'<div class="history-section"><div class="history-title">Recent Analyses</div><div class="history-grid">{items_html}</div></div>', unsafe_allow_html=True)
 
@@ -1891,3 +1752,10 @@ elif st.session_state.page == "about":
         </div>
     </div>
     """, unsafe_allow_html=True)
+
+# Refresh while a batch job runs so its results show up as they finish
+if st.session_state.page == "home" and st.session_state.analysis_mode == "batch":
+    batch_job = get_batch_job(st.session_state.batch_job_id)
+    if batch_job is not None and batch_job.running:
+        time.sleep(BATCH_JOB_POLL_INTERVAL)
+        st.rerun()
@@ -0,0 +1,9 @@
+"""ImageTruth inference core: decoding, caching and ViT analysis without Streamlit
+
+Importing the package is cheap. torch and transformers are only imported once models
+are loaded, so scripts and workers that never run a model never pay for them.
+"""
+from .images import get_image_derivatives, load_url, open_image
+from .pipeline import (
+    analyze_derivatives, analyze_image, analyze_images, get_analyzer, get_model_registry, load_vit_models,
+)
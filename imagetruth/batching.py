@@ -0,0 +1,124 @@
+"""Micro-batching: concurrent single-image requests share one batched forward pass"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class Overloaded(Exception):
+    """The wait queue stayed full for longer than the caller was willing to wait"""
+
+class MicroBatcher:
+    """Coalesces items submitted within a short window into batches for a fixed pool of worker threads
+
+    run_batch(items) must return one result per item, in order. Items already queued are
+    taken straight away; the window only bounds how long a partial batch waits for more.
+    At most max_queued items wait for a worker (0 for no bound); init_worker() runs once on
+    each worker thread before its first batch.
+    """
+
+    def __init__(self, run_batch, max_batch, window, workers=1, max_queued=0, timeout=None, init_worker=None):
+        self.max_batch = max_batch
+        self.window = window
+        self.workers = workers
+        self.timeout = timeout
+        self.batches = 0
+        self.items = 0
+        self.busy = 0
+        self.peak_queued = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self._run_batch = run_batch
+        self._init_worker = init_worker
+        self._queue = queue.Queue(max_queued)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._take_lock = threading.Lock()
+
+    def submit(self, item):
+        """Queue one item; returns a Future for its result. Raises Overloaded if the queue stays full"""
+        future = Future()
+        self._start()
+        try:
+            self._queue.put((item, future, time.monotonic()), timeout=self.timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded(f"{self._queue.maxsize} images already waiting for inference") from None
+        queued = self._queue.qsize()
+        if queued > self.peak_queued:
+            self.peak_queued = queued
+        return future
+
+    def map(self, items):
+        """Queue several items and wait for all of their results"""
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+            "mean_wait_ms": 1000 * self.wait_time / self.items if self.items else 0.0,
+            "queued": self._queue.qsize(),
+            "peak_queued": self.peak_queued,
+            "max_queued": self._queue.maxsize,
+            "rejected": self.rejected,
+            "workers": self.workers,
+            "busy": self.busy,
+        }
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._loop, name=f"inference-worker-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _loop(self):
+        if self._init_worker is not None:
+            self._init_worker()
+        while True:
+            # One worker gathers a batch at a time, so idle workers don't split a burst into slivers
+            with self._take_lock:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+            start = time.monotonic()
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            self._run([(item, future) for item, future, _ in batch], sum(start - queued_at for _, _, queued_at in batch))
+
+    def _run(self, batch, wait_time):
+        if not batch:
+            return
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.wait_time += wait_time
+            self.busy += 1
+        try:
+            self._run_items(batch)
+        finally:
+            with self._lock:
+                self.busy -= 1
+
+    def _run_items(self, batch):
+        try:
+            results = self._run_batch([item for item, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Retry one by one so a single bad input only fails its own request
+            for item, future in batch:
+                try:
+                    future.set_result(self._run_batch([item])[0])
+                except Exception as item_error:
+                    future.set_exception(item_error)
+            return
+        for (_, future), res in zip(batch, results):
+            future.set_result(res)
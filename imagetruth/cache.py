@@ -0,0 +1,260 @@
+"""Result caches: in-memory LRU, optional SQLite cache on disk and the near-duplicate index"""
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from .config import (
+    DISK_CACHE_MAX_ITEMS, DISK_CACHE_PATH, DISK_CACHE_TTL, NEAR_DUP_INDEX_SIZE, NEAR_DUP_THRESHOLD,
+    RESULT_CACHE_SIZE,
+)
+
+def singleton(factory):
+    """Like functools.cache for a no-argument factory, but concurrent first calls build it only once
+
+    As with st.cache_resource, an exception isn't cached; the next call tries again.
+    """
+    state = {"lock": threading.Lock()}
+
+    @functools.wraps(factory)
+    def get():
+        if "value" not in state:
+            with state["lock"]:
+                if "value" not in state:
+                    state["value"] = factory()
+        return state["value"]
+
+    def cache_clear():
+        # Also used in forked children, where another parent thread may have held the lock
+        state.clear()
+        state["lock"] = threading.Lock()
+
+    get.cache_clear = cache_clear
+    return get
+
+class LRUCache:
+    """Thread-safe bounded mapping with least-recently-used eviction and hit/miss counters"""
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def items(self):
+        """(key, value) pairs, least recently used first"""
+        with self._lock:
+            return list(self._items.items())
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._items), "max_items": self.max_items}
+
+    def __len__(self):
+        return len(self._items)
+
+class DiskResultCache:
+    """SQLite-backed result cache with TTL and size-based eviction"""
+
+    EVICT_EVERY = 100  # Puts between eviction sweeps
+
+    def __init__(self, path, ttl, max_items):
+        self.path = path
+        self.ttl = ttl
+        self.max_items = max_items
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        # WAL lets several Streamlit processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    def get(self, key):
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] > self.ttl:
+                    self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    return None
+                self._conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            return None
+        return deserialize_result(row[0])
+
+    def put(self, key, res):
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, serialize_result(res), now, now),
+                )
+                self._puts += 1
+                if self._puts % self.EVICT_EVERY == 0:
+                    self._evict(now)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM results WHERE key IN ("
+            "SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_items,),
+        )
+
+def result_to_json(res):
+    """Copy of a result dict that json can encode (numpy probabilities become lists)"""
+    data = dict(res)
+    if "probs" in data:
+        data["probs"] = [float(p) for p in data["probs"]]
+    return data
+
+def result_from_json(data):
+    """Inverse of result_to_json"""
+    if "probs" in data:
+        data["probs"] = np.array(data["probs"], dtype=np.float32)
+    return data
+
+def serialize_result(res):
+    """Encode a result dict as JSON"""
+    return json.dumps(result_to_json(res))
+
+def deserialize_result(text):
+    """Decode a result dict written by serialize_result"""
+    return result_from_json(json.loads(text))
+
+class NearDuplicateIndex:
+    """BK-tree over image dHashes for Hamming-distance near-duplicate lookups"""
+
+    def __init__(self, threshold, max_items):
+        self.threshold = threshold
+        self.max_items = max_items
+        self._recent = OrderedDict()  # cache key -> hash, newest last
+        self._root = None  # (hash, cache key, {distance: child})
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def add(self, hash_value, key):
+        with self._lock:
+            self._recent[key] = hash_value
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.max_items:
+                self._recent.popitem(last=False)
+            self._insert(hash_value, key)
+            # BK-trees can't delete, so rebuild from the recent entries once stale ones pile up
+            if self._size > 2 * self.max_items:
+                self._root = None
+                self._size = 0
+                for recent_key, recent_hash in self._recent.items():
+                    self._insert(recent_hash, recent_key)
+
+    def _insert(self, hash_value, key):
+        node = (hash_value, key, {})
+        self._size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = (hash_value ^ current[0]).bit_count()
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def find(self, hash_value):
+        """Return the cache keys of every hash within the threshold, closest first"""
+        matches = {}
+        with self._lock:
+            stack = [self._root] if self._root is not None else []
+            while stack:
+                node_hash, node_key, children = stack.pop()
+                distance = (hash_value ^ node_hash).bit_count()
+                # Stale tree nodes (dropped from _recent, not yet rebuilt away) don't count
+                if distance <= self.threshold and self._recent.get(node_key) == node_hash:
+                    matches[node_key] = min(distance, matches.get(node_key, distance))
+                # Triangle inequality: only these subtrees can hold hashes within the threshold
+                for child_distance, child in children.items():
+                    if abs(child_distance - distance) <= self.threshold:
+                        stack.append(child)
+        return sorted(matches, key=matches.get)
+
+def get_dhash(image):
+    """64-bit difference hash: stable across resizing and JPEG recompression"""
+    gray = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+@singleton
+def get_result_cache():
+    """Process-wide analysis result cache shared by every session"""
+    return LRUCache(RESULT_CACHE_SIZE)
+
+@singleton
+def get_disk_result_cache():
+    """Persistent result cache, or None when IMAGETRUTH_DISK_CACHE is unset or can't be opened"""
+    if not DISK_CACHE_PATH:
+        return None
+    try:
+        return DiskResultCache(DISK_CACHE_PATH, DISK_CACHE_TTL, DISK_CACHE_MAX_ITEMS)
+    except sqlite3.Error as e:
+        # The cache is optional: run without it rather than failing every analysis
+        warnings.warn(f"IMAGETRUTH_DISK_CACHE {DISK_CACHE_PATH!r} is unusable, results won't persist ({e})")
+        return None
+
+@singleton
+def get_near_dup_index():
+    """Process-wide near-duplicate index, or None when turned off"""
+    if NEAR_DUP_THRESHOLD < 0:
+        return None
+    return NearDuplicateIndex(NEAR_DUP_THRESHOLD, NEAR_DUP_INDEX_SIZE)
+
+def lookup_cached_result(key, cache, disk_cache):
+    """Look a result up in memory, then on disk, promoting disk hits into memory"""
+    res = cache.get(key)
+    if res is None and disk_cache is not None:
+        res = disk_cache.get(key)
+        if res is not None:
+            cache.put(key, res)
+    return res
+
+def get_image_hash(image):
+    """Hash the decoded pixels, so re-uploads of the same image share a key"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{image.size}:".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
@@ -0,0 +1,73 @@
+"""Client for imagetruth.server with the same analyze/status interface as ModelRegistry"""
+import base64
+import threading
+import time
+
+from .cache import result_from_json
+from .config import SERVER_TIMEOUT
+
+class InferenceClient:
+    """Sends model inputs to a running inference server instead of loading models in-process"""
+
+    HEALTH_TTL = 1.0  # Seconds a /health answer is reused, so page reruns don't poll constantly
+    MAX_RETRIES = 30  # 503s tolerated per request, each waiting the server's Retry-After
+
+    def __init__(self, url, timeout=SERVER_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.error = None
+        self._status = "loading"
+        self._checked = 0.0
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        """Per-thread requests session, so each page thread keeps its own connection alive"""
+        import requests
+
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    @property
+    def status(self):
+        import requests
+
+        if time.monotonic() - self._checked > self.HEALTH_TTL:
+            try:
+                resp = self.session.get(f"{self.url}/health", timeout=5)
+                resp.raise_for_status()
+                health = resp.json()
+                self._status, self.error = health["status"], health.get("error")
+            except (requests.RequestException, ValueError, KeyError) as e:
+                self._status, self.error = "error", f"inference server at {self.url} is unreachable ({e})"
+            self._checked = time.monotonic()
+        return self._status
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    def retry(self):
+        """The server retries its own failed loads; status picks up the outcome"""
+
+    def analyze(self, derivatives):
+        """Analyze ImageDerivatives on the server, one result dict per image"""
+        payload = {"images": [
+            {
+                "id": d.image_id,
+                "size": list(d.model_input.size),
+                "pixels": base64.b64encode(d.model_input.tobytes()).decode(),
+            }
+            for d in derivatives
+        ]}
+        for _ in range(self.MAX_RETRIES):
+            resp = self.session.post(f"{self.url}/analyze_batch", json=payload, timeout=self.timeout)
+            if resp.status_code == 503:
+                # Backpressure: the server's queue is full, wait as long as it asks
+                time.sleep(float(resp.headers.get("Retry-After", 1)))
+                continue
+            if resp.status_code != 200:
+                raise RuntimeError(resp.json().get("error", f"Inference server returned {resp.status_code}"))
+            return [result_from_json(res) for res in resp.json()["results"]]
+        raise RuntimeError("Inference server is overloaded, try again shortly")
@@ -0,0 +1,171 @@
+"""Settings for the inference core, read once from IMAGETRUTH_* environment variables"""
+import functools
+import os
+
+VIT_IMG_SIZE = 224
+BATCH_SIZE = 16  # Images per forward pass in batch mode
+WARMUP_BATCH_SIZES = (1, BATCH_SIZE)  # Batch shapes exercised by the load-time warmup
+PREVIEW_MAX_SIZE = 800  # Largest preview rendered in the UI
+BATCH_PREVIEW_SIZE = 300  # Batch grid cards
+HISTORY_THUMB_SIZE = 80  # Recent analyses strip
+DERIVATIVES_CACHE_SIZE = 32  # Decoded images whose previews and model input stay memoized
+
+# Byte budgets for encoded previews. Batch pages share one total budget, so very large
+# batches get smaller thumbnails instead of an ever-growing page.
+RESULT_PREVIEW_BYTES = 120_000
+BATCH_PREVIEW_BYTES = 25_000
+BATCH_PAGE_BYTES = 2_000_000
+HISTORY_THUMB_BYTES = 4_000
+MIN_PREVIEW_BYTES = 2_000
+PREVIEW_QUALITIES = (85, 75, 65, 55, 45, 35)  # Tried best first, then bisected
+# "webp" (default), "avif" (smaller but several times slower to encode) or "jpeg"
+PREVIEW_FORMAT = os.environ.get("IMAGETRUTH_PREVIEW_FORMAT", "webp")
+
+# Decode large uploads only at the resolution the model input and previews need.
+# Set to 1 to always decode at full resolution.
+FULL_RES_DECODE = os.environ.get("IMAGETRUTH_FULL_RES_DECODE", "0") == "1"
+
+# ViT Model configurations
+BINARY_MODEL_NAME = "gechen98/AI_image_classification"
+MULTICLASS_MODEL_NAME = "gechen98/AI_image_generator_classification"
+VIT_BASE_MODEL = "google/vit-base-patch16-224"
+
+# Local model artifacts, one directory per model: model.safetensors, config.json,
+# preprocessor_config.json and the pinned hub revision in revision.txt. Written by
+# scripts/export_artifacts.py; models found here load offline from a memory-mapped file,
+# anything missing falls back to the Hugging Face hub.
+MODEL_ARTIFACT_DIR = os.environ.get("IMAGETRUTH_MODEL_DIR", os.path.join("models", "vit"))
+
+# Binary detector: "vit" (default) or "legacy_cnn", the 128x128 Keras CNN from app_original.py.
+# The legacy CNN needs TensorFlow, which is only imported when it is selected.
+BINARY_BACKEND = os.environ.get("IMAGETRUTH_BINARY_BACKEND", "vit")
+LEGACY_MODEL_PATH = os.environ.get("IMAGETRUTH_LEGACY_MODEL", os.path.join("models", "basic_cnn.keras"))
+LEGACY_IMG_SIZE = (128, 128)
+
+# Optional shared-trunk model (one encoder, binary + generator heads), trained in
+# notebooks/shared_trunk_vit.ipynb. Leave unset to use the two separate models.
+SHARED_MODEL_NAME = os.environ.get("IMAGETRUTH_SHARED_MODEL", "")
+
+# Weight precision applied at load time, all but fp32 on CPU only:
+#   "fp32" (default), "int8" (dynamic INT8 Linear layers),
+#   "bf16" (bf16 weights + bf16 autocast; falls back to fp16 on CPUs without native bf16),
+#   "fp16" (fp16-stored Linear weights, fp32 compute)
+MODEL_PRECISION = os.environ.get("IMAGETRUTH_PRECISION", "fp32")
+MODEL_PRECISIONS = ("fp32", "int8", "bf16", "fp16")
+
+# Inference backend: "torch" (default, eager PyTorch) or "onnx" (ONNX Runtime on CPU).
+# ONNX exports are written once to ONNX_CACHE_DIR and reused on later starts.
+INFERENCE_BACKEND = os.environ.get("IMAGETRUTH_BACKEND", "torch")
+INFERENCE_BACKENDS = ("torch", "onnx")
+ONNX_CACHE_DIR = os.environ.get("IMAGETRUTH_ONNX_DIR", os.path.join("models", "onnx"))
+ONNX_THREADS = int(os.environ.get("IMAGETRUTH_ONNX_THREADS", 0))  # 0 uses CPU_COUNT
+ONNX_OPSET = 17
+
+# Ahead-of-time graph mode for the torch backend: "none" (eager), "trace" (TorchScript) or
+# "compile" (torch.compile). Warmup runs dummy batches at load so the first request is warm.
+MODEL_COMPILE = os.environ.get("IMAGETRUTH_COMPILE", "none")
+MODEL_COMPILE_MODES = ("none", "trace", "compile")
+WARMUP = os.environ.get("IMAGETRUTH_WARMUP", "0" if MODEL_COMPILE == "none" else "1") == "1"
+
+# A failed model load (a hub or network blip, say) is retried by the next request or page run
+# once this many seconds have passed; until then the error is reported
+MODEL_RETRY_COOLDOWN = float(os.environ.get("IMAGETRUTH_MODEL_RETRY_COOLDOWN", 60))
+
+# Concurrent requests (across every session in the process) arriving within this many
+# milliseconds are analyzed in one forward pass of up to BATCH_SIZE images. 0 only
+# batches requests that are already queued.
+MICROBATCH_WINDOW_MS = float(os.environ.get("IMAGETRUTH_BATCH_WINDOW_MS", 10))
+
+# Inference runs on a fixed pool of INFERENCE_WORKERS threads, each limited to its share of the
+# cores, so concurrent sessions queue for a worker instead of all running torch at once. Once
+# INFERENCE_QUEUE_SIZE images are waiting, new ones wait up to INFERENCE_QUEUE_TIMEOUT seconds.
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+INFERENCE_WORKERS = int(os.environ.get("IMAGETRUTH_INFERENCE_WORKERS", 1))
+INFERENCE_THREADS = max(1, CPU_COUNT // max(1, INFERENCE_WORKERS))  # torch threads per worker
+INFERENCE_QUEUE_SIZE = int(os.environ.get("IMAGETRUTH_INFERENCE_QUEUE", 256))
+INFERENCE_QUEUE_TIMEOUT = float(os.environ.get("IMAGETRUTH_INFERENCE_QUEUE_TIMEOUT", 60))
+
+# Batch mode can shard big uploads across forked worker processes that share the loaded models
+# copy-on-write, so decoding and preprocessing aren't bound by one GIL. Only used with the torch
+# backend on CPU where fork is available; 0 keeps Batch mode in the app process.
+BATCH_PROCESSES = int(os.environ.get("IMAGETRUTH_BATCH_PROCESSES", 0))
+BATCH_PROCESS_MIN_FILES = 2 * BATCH_SIZE  # Smaller uploads aren't worth the fork
+
+# Batch mode runs as background jobs that outlive the script run that started them
+BATCH_JOB_HISTORY = int(os.environ.get("IMAGETRUTH_BATCH_JOB_HISTORY", 32))  # Jobs kept to come back to
+BATCH_JOB_POLL_INTERVAL = 1.0  # Seconds between page refreshes while a job runs
+
+# Optional standalone inference server (python -m imagetruth.server). When IMAGETRUTH_SERVER_URL
+# is set the app sends model inputs there instead of loading the models itself.
+SERVER_URL = os.environ.get("IMAGETRUTH_SERVER_URL", "")
+SERVER_HOST = os.environ.get("IMAGETRUTH_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("IMAGETRUTH_SERVER_PORT", 8765))
+SERVER_MAX_PENDING = int(os.environ.get("IMAGETRUTH_SERVER_MAX_PENDING", 256))  # Images queued before 503s
+SERVER_MAX_REQUEST_BYTES = 64 * 2**20
+SERVER_TIMEOUT = 120  # Seconds a client waits for one request
+
+# The generator model is only loaded once an image is flagged as AI. Set to 1 to load it on
+# a background thread as soon as the binary model is ready instead.
+PREFETCH_GENERATOR = os.environ.get("IMAGETRUTH_PREFETCH_GENERATOR", "0") == "1"
+
+def get_artifact_dir(model_name):
+    """Local artifact directory for a model, or None when it hasn't been exported"""
+    path = os.path.join(MODEL_ARTIFACT_DIR, model_name.replace("/", "__"))
+    return path if os.path.isdir(path) else None
+
+def get_pinned_name(model_name):
+    """Model name qualified with the revision its local artifacts were exported from"""
+    path = get_artifact_dir(model_name)
+    if path is None or not os.path.exists(os.path.join(path, "revision.txt")):
+        return model_name
+    with open(os.path.join(path, "revision.txt")) as f:
+        return f"{model_name}@{f.read().strip()}"
+
+# Identifies the models behind a cached result, so a model change never serves stale results
+BINARY_MODEL_ID = LEGACY_MODEL_PATH if BINARY_BACKEND == "legacy_cnn" else get_pinned_name(BINARY_MODEL_NAME)
+MODEL_IDS = get_pinned_name(SHARED_MODEL_NAME) if SHARED_MODEL_NAME else f"{BINARY_MODEL_ID}+{get_pinned_name(MULTICLASS_MODEL_NAME)}"
+RESULT_CACHE_SIZE = 1024  # Max results kept in the process-wide LRU cache
+
+# Optional SQLite result cache that survives restarts and is shared by every worker on the host
+DISK_CACHE_PATH = os.environ.get("IMAGETRUTH_DISK_CACHE", "")
+DISK_CACHE_TTL = int(os.environ.get("IMAGETRUTH_DISK_CACHE_TTL", 7 * 24 * 3600))  # seconds
+DISK_CACHE_MAX_ITEMS = int(os.environ.get("IMAGETRUTH_DISK_CACHE_MAX_ITEMS", 200_000))
+
+# Resized/recompressed copies reuse a cached verdict when their 64-bit dHashes differ by
+# at most this many bits. A negative value turns near-duplicate lookups off.
+NEAR_DUP_THRESHOLD = int(os.environ.get("IMAGETRUTH_NEAR_DUP_THRESHOLD", 6))
+NEAR_DUP_INDEX_SIZE = 10_000  # Most recent hashes kept in the near-duplicate index
+
+# Multiclass labels
+MULTICLASS_LABELS = ['glide', 'midjourney', 'wukong', 'adm', 'sdv5', 'vqdm', 'biggan']
+
+@functools.cache
+def get_device():
+    """Device for PyTorch (imports torch, so only the modules that run models call it)"""
+    import torch
+
+    use_cuda = torch.cuda.is_available() and MODEL_PRECISION == "fp32" and INFERENCE_BACKEND == "torch"
+    return torch.device('cuda' if use_cuda else 'cpu')
+
+@functools.cache
+def cpu_supports_bf16():
+    """Whether oneDNN has native bf16 kernels here (AVX512-BF16/AMX); elsewhere bf16 is emulated"""
+    import torch
+
+    check = getattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported", None)
+    try:
+        return bool(check and check())
+    except RuntimeError:
+        return False
+
+@functools.cache
+def get_model_precision():
+    """The precision the models actually run at: bf16 becomes fp16 storage without native bf16"""
+    if MODEL_PRECISION == "bf16" and not cpu_supports_bf16():
+        return "fp16"
+    return MODEL_PRECISION
+
+@functools.cache
+def get_model_revision():
+    """Cache key prefix for results; uses the effective precision, so bf16 and its fp16 fallback never mix"""
+    return f"{MODEL_IDS}@{get_model_precision()}/{INFERENCE_BACKEND}"
@@ -0,0 +1,163 @@
+"""Image decoding, preview encoding and the per-image derivatives built from one decode"""
+import threading
+from io import BytesIO
+
+from PIL import Image, features
+
+from .cache import LRUCache, get_image_hash, singleton
+from .config import (
+    BATCH_PAGE_BYTES, BATCH_PREVIEW_BYTES, BATCH_PREVIEW_SIZE, DERIVATIVES_CACHE_SIZE, FULL_RES_DECODE,
+    HISTORY_THUMB_SIZE, MIN_PREVIEW_BYTES, PREVIEW_FORMAT, PREVIEW_MAX_SIZE, PREVIEW_QUALITIES,
+    RESULT_PREVIEW_BYTES, VIT_IMG_SIZE,
+)
+
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "CMYK", "YCbCr", "I", "F")
+
+def get_decode_scale(size):
+    """Smallest scale that keeps the long side >= the largest preview and both sides >= the model input"""
+    width, height = size
+    return min(1.0, max(PREVIEW_MAX_SIZE / max(width, height), VIT_IMG_SIZE / min(width, height)))
+
+def open_image(source, full_res=None):
+    """Open and decode an image, scaling oversized ones down during decode"""
+    if full_res is None:
+        full_res = FULL_RES_DECODE
+    img = Image.open(source)
+    original_size = img.size
+    if not full_res:
+        scale = get_decode_scale(img.size)
+        if img.format == "JPEG" and scale <= 0.5:
+            # DCT-domain scaling: libjpeg decodes straight to 1/2, 1/4 or 1/8 size
+            img.draft("RGB", (int(img.width * scale) + 1, int(img.height * scale) + 1))
+        img.load()
+        # Formats without draft support still get reduced right after decode
+        factor = int(1 / get_decode_scale(img.size))
+        if factor >= 2:
+            # Averaging palette indices or 1-bit pixels is meaningless (and reduce() rejects them);
+            # such images end up as RGB for the model and previews anyway
+            if img.mode not in REDUCIBLE_MODES:
+                img = img.convert("RGB")
+            img = img.reduce(factor)
+    else:
+        img.load()
+    img.info["original_size"] = original_size
+    return img
+
+def get_original_size(img):
+    """Size of the image as uploaded, before any reduced-resolution decode"""
+    return img.info.get("original_size", img.size)
+
+def load_url(url):
+    import requests
+
+    resp = requests.get(url, timeout=10)
+    resp.raise_for_status()
+    return open_image(BytesIO(resp.content))
+
+def get_preview_format():
+    """Preview format, falling back to JPEG when this Pillow build can't encode the configured one"""
+    if PREVIEW_FORMAT == "avif" and "avif" in features.get_supported_modules():
+        return "AVIF", "image/avif", {"speed": 8}
+    if PREVIEW_FORMAT in ("avif", "webp") and features.check("webp"):
+        return "WEBP", "image/webp", {"method": 4}
+    return "JPEG", "image/jpeg", {"optimize": True}
+
+def encode_preview(image, max_bytes):
+    """Encode at the best quality that fits max_bytes, shrinking the image if even the lowest doesn't"""
+    fmt, mimetype, options = get_preview_format()
+
+    def encode(img, quality):
+        buf = BytesIO()
+        img.save(buf, format=fmt, quality=quality, **options)
+        return buf.getvalue()
+
+    while True:
+        data = encode(image, PREVIEW_QUALITIES[0])
+        if len(data) <= max_bytes:
+            return data, mimetype
+        # Bisect the remaining qualities for the highest one that fits
+        best = None
+        lo, hi = 1, len(PREVIEW_QUALITIES) - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            data = encode(image, PREVIEW_QUALITIES[mid])
+            if len(data) <= max_bytes:
+                best, hi = data, mid - 1
+            else:
+                lo = mid + 1
+        if best is not None:
+            return best, mimetype
+        if max(image.size) <= 64:
+            return encode(image, PREVIEW_QUALITIES[-1]), mimetype
+        image = image.resize((max(1, image.width * 3 // 4), max(1, image.height * 3 // 4)), Image.Resampling.LANCZOS)
+
+def get_batch_preview_bytes(count):
+    """Per-thumbnail budget for a batch page of count images"""
+    return max(MIN_PREVIEW_BYTES, min(BATCH_PREVIEW_BYTES, BATCH_PAGE_BYTES // max(count, 1)))
+
+class ImageDerivatives:
+    """Everything built from one decoded image (model input, previews, thumbnail), each built once"""
+
+    def __init__(self, image, image_id):
+        self.image = image
+        self.image_id = image_id
+        self.original_size = get_original_size(image)
+        self._rgb = None
+        self._model_input = None
+        self._pyramid = {}  # max side -> thumbnail
+        self._previews = {}  # (max side, byte budget) -> (bytes, mimetype)
+        self._lock = threading.Lock()
+
+    @property
+    def rgb(self):
+        with self._lock:
+            if self._rgb is None:
+                self._rgb = self.image if self.image.mode == "RGB" else self.image.convert("RGB")
+            return self._rgb
+
+    @property
+    def model_input(self):
+        """The 224x224 image the ViT sees, resized straight from the decoded image"""
+        rgb = self.rgb
+        with self._lock:
+            if self._model_input is None:
+                self._model_input = rgb.resize((VIT_IMG_SIZE, VIT_IMG_SIZE), Image.Resampling.BILINEAR)
+            return self._model_input
+
+    def resized(self, max_size):
+        """Thumbnail fitting max_size, built from the next larger pyramid level"""
+        rgb = self.rgb
+        with self._lock:
+            if max_size not in self._pyramid:
+                larger = [size for size in self._pyramid if size > max_size]
+                source = self._pyramid[min(larger)] if larger else rgb
+                thumb = source.copy()
+                thumb.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+                self._pyramid[max_size] = thumb
+            return self._pyramid[max_size]
+
+    def preview(self, max_size=PREVIEW_MAX_SIZE, max_bytes=RESULT_PREVIEW_BYTES):
+        """(bytes, mimetype) of a preview within max_bytes, encoded once per size and budget"""
+        key = (max_size, max_bytes)
+        if key not in self._previews:
+            # Build levels largest first so smaller ones come from the pyramid, not the full image
+            for size in sorted({PREVIEW_MAX_SIZE, BATCH_PREVIEW_SIZE, HISTORY_THUMB_SIZE, max_size}, reverse=True):
+                if size >= max_size:
+                    self.resized(size)
+            self._previews[key] = encode_preview(self.resized(max_size), max_bytes)
+        return self._previews[key]
+
+@singleton
+def get_derivatives_cache():
+    """Process-wide memo of ImageDerivatives keyed by image id"""
+    return LRUCache(DERIVATIVES_CACHE_SIZE)
+
+def get_image_derivatives(img):
+    """Derivatives for a decoded image, shared by every path and rerun that sees the same pixels"""
+    image_id = get_image_hash(img)
+    cache = get_derivatives_cache()
+    derivatives = cache.get(image_id)
+    if derivatives is None:
+        derivatives = ImageDerivatives(img, image_id)
+        cache.put(image_id, derivatives)
+    return derivatives
@@ -0,0 +1,180 @@
+"""Preprocessing and batched prediction with loaded ViT models (imports torch)"""
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from .config import MULTICLASS_LABELS, VIT_IMG_SIZE, get_device
+from .models import LazyModel, resolve_model
+
+DEVICE = get_device()
+
+class FusedViTTransform:
+    """Resize + ToTensor + Normalize over a whole batch: one uint8 buffer, one vectorized normalize"""
+
+    def __init__(self, mean, std, size=VIT_IMG_SIZE):
+        self.size = size
+        # (x / 255 - mean) / std folded into a single multiply-add per element
+        self.scale = torch.tensor([1 / (255 * s) for s in std], device=DEVICE).view(1, 3, 1, 1)
+        self.shift = torch.tensor([-m / s for m, s in zip(mean, std)], device=DEVICE).view(1, 3, 1, 1)
+
+    def __call__(self, image):
+        return self.batch([image])[0]
+
+    def batch(self, images):
+        buffer = np.empty((len(images), self.size, self.size, 3), dtype=np.uint8)
+        for i, image in enumerate(images):
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            if image.size != (self.size, self.size):
+                # Same filter torchvision's Resize uses for PIL images
+                image = image.resize((self.size, self.size), Image.Resampling.BILINEAR)
+            buffer[i] = np.asarray(image)
+        # Move uint8 to the device (4x less data than float), then normalize in place
+        pixels = torch.from_numpy(buffer).to(DEVICE).permute(0, 3, 1, 2).float()
+        return pixels.mul_(self.scale).add_(self.shift)
+
+def get_vit_transforms(processor, fused=True):
+    """Get transforms for ViT models (fused=False gives the torchvision reference pipeline)"""
+    mean = processor.image_mean
+    std = processor.image_std
+    if fused:
+        return FusedViTTransform(mean, std)
+    return transforms.Compose([
+        transforms.Resize((VIT_IMG_SIZE, VIT_IMG_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=mean, std=std),
+    ])
+
+def preprocess_vit(image, transform):
+    """Preprocess image for ViT model"""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    tensor = transform(image).unsqueeze(0).to(DEVICE)
+    return tensor
+
+def preprocess_vit_batch(images, transform):
+    """Preprocess a list of images into one ViT pixel_values batch"""
+    if isinstance(transform, FusedViTTransform):
+        return transform.batch(images)
+    tensors = []
+    for image in images:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        tensors.append(transform(image))
+    return torch.stack(tensors).to(DEVICE)
+
+def predict_vit_binary(model, image_tensor):
+    """Predict using binary ViT model"""
+    return predict_vit_binary_batch(model, image_tensor)[0]
+
+def predict_vit_binary_batch(model, pixel_values):
+    """Predict a batch with the binary ViT model, one result dict per image"""
+    with torch.no_grad():
+        outputs = model(pixel_values=pixel_values)
+        batch_probs = torch.softmax(outputs.logits, dim=1).cpu()
+    return binary_results_from_probs(batch_probs)
+
+def binary_results_from_probs(batch_probs):
+    """Build binary result dicts from a batch of ai/nature probabilities"""
+    results = []
+    for probs in batch_probs:
+        pred_id = int(probs.argmax().item())
+        confidence = float(probs[pred_id].item()) * 100
+        
+        # id2label: {0: 'ai', 1: 'nature'}
+        is_ai = pred_id == 0
+        label = "AI Generated" if is_ai else "Real Image"
+        
+        results.append({
+            "label": label,
+            "is_ai": is_ai,
+            "confidence": confidence,
+            "raw": float(probs[0].item()),  # AI probability
+            "probs": probs.numpy()
+        })
+    return results
+
+def predict_vit_multiclass(model, image_tensor):
+    """Predict using multiclass ViT model to identify AI generator type"""
+    return predict_vit_multiclass_batch(model, image_tensor)[0]
+
+def get_multiclass_label(model, class_id):
+    """Get a generator label from the model config or fall back to our list"""
+    if hasattr(model.config, 'id2label') and model.config.id2label:
+        return model.config.id2label[class_id]
+    return MULTICLASS_LABELS[class_id]
+
+def predict_vit_multiclass_batch(model, pixel_values):
+    """Predict a batch with the multiclass ViT model, one result dict per image"""
+    with torch.no_grad():
+        outputs = model(pixel_values=pixel_values)
+        batch_probs = torch.softmax(outputs.logits, dim=1).cpu()
+    return multiclass_results_from_probs(model, batch_probs)
+
+def multiclass_results_from_probs(model, batch_probs):
+    """Build generator result dicts from a batch of generator probabilities"""
+    results = []
+    for probs in batch_probs:
+        pred_id = int(probs.argmax().item())
+        confidence = float(probs[pred_id].item()) * 100
+        
+        # Build all class probabilities
+        all_probs = {}
+        for i, prob in enumerate(probs.numpy()):
+            all_probs[get_multiclass_label(model, i)] = float(prob) * 100
+        
+        results.append({
+            "label": get_multiclass_label(model, pred_id),
+            "is_ai": True,  # All multiclass predictions are AI generators
+            "confidence": confidence,
+            "raw": float(probs[pred_id].item()),
+            "all_probs": all_probs,
+            "pred_id": pred_id
+        })
+    return results
+
+def predict_vit_shared_batch(model, pixel_values):
+    """Predict a batch with the shared-trunk model: one encoder pass, both heads"""
+    with torch.no_grad():
+        outputs = model(pixel_values=pixel_values)
+        binary_probs = torch.softmax(outputs.binary_logits, dim=1).cpu()
+        generator_probs = torch.softmax(outputs.generator_logits, dim=1).cpu()
+    
+    results = binary_results_from_probs(binary_probs)
+    generator_results = multiclass_results_from_probs(model, generator_probs)
+    for res, multiclass_res in zip(results, generator_results):
+        if res["is_ai"]:
+            set_generator_fields(res, multiclass_res)
+    return results
+
+def set_generator_fields(res, multiclass_res):
+    """Copy the generator prediction onto a binary result"""
+    res["generator"] = multiclass_res["label"]
+    res["generator_confidence"] = multiclass_res["confidence"]
+    res["all_probs"] = multiclass_res["all_probs"]
+
+def add_generator_predictions(binary_results, pixel_values, vit_multiclass_model, wait=True):
+    """Run the generator classifier as one sub-batch over the AI-flagged images only
+
+    With wait=False a generator model that isn't loaded yet starts loading in the background and
+    the AI-flagged results come back marked generator_pending instead of blocking the caller.
+    """
+    ai_indices = [i for i, res in enumerate(binary_results) if res["is_ai"]]
+    if not ai_indices:
+        return binary_results
+    
+    if not wait and isinstance(vit_multiclass_model, LazyModel) and not vit_multiclass_model.loaded:
+        vit_multiclass_model.prefetch()
+        for i in ai_indices:
+            binary_results[i]["generator_pending"] = True
+        return binary_results
+    
+    index = torch.tensor(ai_indices, device=pixel_values.device)
+    vit_multiclass_model = resolve_model(vit_multiclass_model)
+    multiclass_results = predict_vit_multiclass_batch(vit_multiclass_model, pixel_values.index_select(0, index))
+    
+    # Scatter the generator info back onto the matching binary results
+    for i, multiclass_res in zip(ai_indices, multiclass_results):
+        set_generator_fields(binary_results[i], multiclass_res)
+    return binary_results
@@ -0,0 +1,116 @@
+"""Background Batch mode jobs: analysis runs off the script thread and results fill in as chunks finish
+
+Jobs live in a process-wide store keyed by id, so a session that leaves the page (or a new one
+opened on the same URL) can pick a job up again while it is still running.
+"""
+import contextlib
+import io
+import threading
+import time
+import uuid
+
+from .cache import LRUCache, singleton
+from .config import BATCH_JOB_HISTORY, BATCH_PREVIEW_SIZE, BATCH_SIZE
+from .images import get_batch_preview_bytes, get_image_derivatives, open_image
+from .pipeline import get_analyzer
+from .sharding import analyze_files, can_shard
+
+class BatchJob:
+    """One Batch mode upload analyzed on a daemon thread; entries keep their upload order slots"""
+
+    def __init__(self, files):
+        self.id = uuid.uuid4().hex
+        self.created = time.time()
+        self.status = "running"
+        self.error = None
+        self.done = 0
+        self.filenames = [name for name, _ in files]
+        self.entries = [None] * len(files)
+        self._files = files
+        self._cancelled = False
+        self._thread = threading.Thread(target=self._run, name=f"batch-job-{self.id[:8]}", daemon=True)
+
+    @property
+    def total(self):
+        return len(self.entries)
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    def results(self):
+        """Entries finished so far, in upload order"""
+        return [entry for entry in self.entries if entry is not None]
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        """Stop after the chunk in flight; finished entries stay"""
+        self._cancelled = True
+
+    def _run(self):
+        try:
+            if can_shard(self.total):
+                self._run_sharded()
+            else:
+                self._run_chunks()
+            self.status = "cancelled" if self._cancelled else "done"
+        except Exception as e:
+            self.status, self.error = "error", e
+        finally:
+            self._files = None  # The uploads aren't needed once analyzed
+
+    def _run_chunks(self):
+        analyzer = get_analyzer()
+        preview_bytes = get_batch_preview_bytes(self.total)
+        for start in range(0, self.total, BATCH_SIZE):
+            if self._cancelled:
+                return
+            # Decode one chunk at a time so the first results show up straight away
+            decoded = []
+            for idx in range(start, min(start + BATCH_SIZE, self.total)):
+                try:
+                    decoded.append((idx, get_image_derivatives(open_image(io.BytesIO(self._files[idx][1])))))
+                except Exception as e:
+                    self._finish(idx, {"error": str(e)}, None)
+            if not decoded:
+                continue
+            try:
+                results = analyzer.analyze([derivatives for _, derivatives in decoded])
+            except Exception as e:
+                results = [{"error": str(e)} for _ in decoded]
+            for (idx, derivatives), res in zip(decoded, results):
+                preview = derivatives.preview(BATCH_PREVIEW_SIZE, preview_bytes) if "error" not in res else None
+                self._finish(idx, res, preview)
+
+    def _run_sharded(self):
+        files = [(idx, data) for idx, (_, data) in enumerate(self._files)]
+        chunks = analyze_files(files, BATCH_PREVIEW_SIZE, get_batch_preview_bytes(self.total))
+        # Closing the generator early shuts the worker pool down
+        with contextlib.closing(chunks):
+            for chunk_results in chunks:
+                for idx, res, preview in chunk_results:
+                    self._finish(idx, res, preview)
+                if self._cancelled:
+                    return
+
+    def _finish(self, idx, res, preview):
+        self.entries[idx] = {"preview": preview, "result": res, "filename": self.filenames[idx]}
+        self.done += 1
+
+@singleton
+def get_batch_jobs():
+    """Recent jobs by id, process-wide so sessions can find theirs again"""
+    return LRUCache(BATCH_JOB_HISTORY)
+
+def start_batch_job(files):
+    """Start analyzing (filename, file bytes) pairs in the background; returns the BatchJob"""
+    job = BatchJob(files)
+    get_batch_jobs().put(job.id, job)
+    job.start()
+    return job
+
+def get_batch_job(job_id):
+    """The job with this id, or None if it is unknown or has been dropped from the history"""
+    return get_batch_jobs().get(job_id) if job_id else None
@@ -0,0 +1,44 @@
+"""Legacy 128x128 Keras CNN (models/basic_cnn.keras) as an optional binary detector
+
+Importing this module imports TensorFlow, which requirements.txt does not install.
+Only load_binary_model imports it, and only for IMAGETRUTH_BINARY_BACKEND=legacy_cnn.
+"""
+import numpy as np
+from tensorflow import keras
+
+from .config import LEGACY_IMG_SIZE
+
+class LegacyCNNModel:
+    """Keras CNN scoring whole images with one sigmoid output, below 0.5 meaning AI"""
+    takes_images = True
+
+    def __init__(self, model):
+        self.model = model
+
+    @classmethod
+    def load(cls, path):
+        return cls(keras.models.load_model(path))
+
+    def predict_batch(self, images):
+        """Binary result dicts in the same shape the ViT produces, one per image"""
+        batch = np.stack([preprocess_legacy(image) for image in images])
+        scores = self.model.predict(batch, verbose=0)[:, 0]
+        return [legacy_result(float(score)) for score in scores]
+
+def preprocess_legacy(image):
+    """RGB, 128x128, scaled to [0, 1]"""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image = image.resize(LEGACY_IMG_SIZE)
+    return np.asarray(image, dtype=np.float32) / 255.0
+
+def legacy_result(score):
+    """Binary result dict from the CNN's sigmoid score (probability of a real image)"""
+    is_ai = score < 0.5
+    return {
+        "label": "AI Generated" if is_ai else "Real Image",
+        "is_ai": is_ai,
+        "confidence": ((1 - score) if is_ai else score) * 100,
+        "raw": 1 - score,  # AI probability, like the ViT results
+        "probs": np.array([1 - score, score], dtype=np.float32),
+    }
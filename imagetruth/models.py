@@ -0,0 +1,357 @@
+"""ViT model classes and loaders for every backend, precision and compile mode
+
+Importing this module imports torch and transformers; the rest of the package only
+does so when models are loaded.
+"""
+import json
+import os
+import shutil
+import struct
+import threading
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+import torch
+from transformers import AutoImageProcessor, ViTConfig, ViTForImageClassification, ViTModel, ViTPreTrainedModel
+from transformers.utils import ModelOutput
+
+from .config import (
+    BINARY_BACKEND, BINARY_MODEL_NAME, CPU_COUNT, INFERENCE_BACKEND, INFERENCE_BACKENDS, LEGACY_MODEL_PATH,
+    MODEL_COMPILE, MODEL_COMPILE_MODES, MODEL_PRECISION, MODEL_PRECISIONS, MULTICLASS_MODEL_NAME, ONNX_CACHE_DIR,
+    ONNX_OPSET, ONNX_THREADS, SHARED_MODEL_NAME, VIT_BASE_MODEL, VIT_IMG_SIZE, WARMUP, WARMUP_BATCH_SIZES,
+    get_artifact_dir, get_device, get_model_precision, get_pinned_name,
+)
+
+DEVICE = get_device()
+
+@dataclass
+class SharedTrunkOutput(ModelOutput):
+    binary_logits: torch.FloatTensor = None
+    generator_logits: torch.FloatTensor = None
+
+class ViTForSharedTrunkClassification(ViTPreTrainedModel):
+    """ViT encoder shared by a binary (ai/nature) head and a generator head"""
+    config_class = ViTConfig
+    is_shared_trunk = True
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.vit = ViTModel(config, add_pooling_layer=False)
+        self.binary_classifier = torch.nn.Linear(config.hidden_size, 2)
+        self.generator_classifier = torch.nn.Linear(config.hidden_size, config.num_labels)
+        self.post_init()
+
+    def forward(self, pixel_values):
+        cls_token = self.vit(pixel_values=pixel_values).last_hidden_state[:, 0, :]
+        return SharedTrunkOutput(
+            binary_logits=self.binary_classifier(cls_token),
+            generator_logits=self.generator_classifier(cls_token),
+        )
+
+def output_names(model_class):
+    """Names of the logits tensors a model class returns"""
+    if getattr(model_class, "is_shared_trunk", False):
+        return ["binary_logits", "generator_logits"]
+    return ["logits"]
+
+class LogitsOnly(torch.nn.Module):
+    """Unwrap a Hugging Face model's output object into a plain tuple of logits for export"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.names = output_names(type(model))
+
+    def forward(self, pixel_values):
+        outputs = self.model(pixel_values=pixel_values)
+        return tuple(getattr(outputs, name) for name in self.names)
+
+class OnnxViTModel:
+    """ONNX Runtime session that stands in for a ViT model in the predict functions"""
+
+    def __init__(self, session, config, model_class):
+        self.session = session
+        self.config = config
+        self.names = output_names(model_class)
+        self.is_shared_trunk = getattr(model_class, "is_shared_trunk", False)
+
+    def __call__(self, pixel_values):
+        outputs = self.session.run(self.names, {"pixel_values": pixel_values.cpu().numpy()})
+        return SimpleNamespace(**{name: torch.from_numpy(out) for name, out in zip(self.names, outputs)})
+
+class TracedViTModel:
+    """TorchScript-traced ViT that stands in for the eager model in the predict functions"""
+
+    def __init__(self, module, config, model_class):
+        self.module = module
+        self.config = config
+        self.names = output_names(model_class)
+        self.is_shared_trunk = getattr(model_class, "is_shared_trunk", False)
+
+    def __call__(self, pixel_values):
+        return SimpleNamespace(**dict(zip(self.names, self.module(pixel_values))))
+
+class AutocastViTModel:
+    """bf16-weight ViT run under CPU autocast that hands fp32 logits to the predict functions"""
+
+    def __init__(self, model):
+        self.model = model
+        self.config = model.config
+        self.names = output_names(type(model))
+        self.is_shared_trunk = getattr(model, "is_shared_trunk", False)
+
+    def __call__(self, pixel_values):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            outputs = self.model(pixel_values=pixel_values)
+        return SimpleNamespace(**{name: getattr(outputs, name).float() for name in self.names})
+
+class Fp16StorageLinear(torch.nn.Module):
+    """Linear layer that keeps its weight in fp16 and upcasts it per call, so the math stays fp32"""
+
+    def __init__(self, linear):
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        self.weight = torch.nn.Parameter(linear.weight.detach().to(torch.float16), requires_grad=False)
+        self.bias = linear.bias
+
+    def forward(self, x):
+        return torch.nn.functional.linear(x, self.weight.to(x.dtype), self.bias)
+
+def to_fp16_storage(module):
+    """Swap every nn.Linear under module for an Fp16StorageLinear, in place"""
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear):
+            setattr(module, name, Fp16StorageLinear(child))
+        else:
+            to_fp16_storage(child)
+    return module
+
+def quantize_int8(model):
+    """Dynamic INT8 Linear layers: weights are quantized once here, activations per batch"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def compile_vit_model(model):
+    """Trace or torch.compile a prepared model according to IMAGETRUTH_COMPILE"""
+    if MODEL_COMPILE == "trace":
+        example = torch.zeros(1, 3, VIT_IMG_SIZE, VIT_IMG_SIZE, device=DEVICE)
+        with torch.no_grad():
+            traced = torch.jit.trace(LogitsOnly(model).eval(), example, strict=False)
+        return TracedViTModel(torch.jit.freeze(traced), model.config, type(model))
+    if MODEL_COMPILE == "compile":
+        # dynamic=True keeps one graph for every batch size instead of recompiling per shape
+        return torch.compile(model, dynamic=True)
+    return model
+
+def warmup_vit_model(model):
+    """Run dummy forwards at the served batch sizes to pay lazy init and allocator warmup up front"""
+    with torch.no_grad():
+        for batch_size in WARMUP_BATCH_SIZES:
+            model(pixel_values=torch.zeros(batch_size, 3, VIT_IMG_SIZE, VIT_IMG_SIZE, device=DEVICE))
+    return model
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+def mmap_safetensors(path):
+    """State dict of tensors viewing a private mmap of a .safetensors file (no copy)
+
+    Read-only pages stay in the page cache shared by every process that maps the file,
+    so N workers on one host hold the weights once instead of N times.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data = torch.empty(0, dtype=torch.uint8).set_(storage)
+    state_dict = {}
+    for name, info in header.items():
+        start, end = (8 + header_size + offset for offset in info["data_offsets"])
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        tensor = data[start:end]
+        if start % dtype.itemsize:
+            tensor = tensor.clone()  # Misaligned for its dtype, can't be viewed in place
+        state_dict[name] = tensor.view(dtype).view(info["shape"])
+    return state_dict
+
+def load_artifact_model(model_class, path):
+    """Build a model from a local artifact directory around its memory-mapped weights"""
+    config = model_class.config_class.from_pretrained(path)
+    # Parameters are created without storage and then replaced by the mmap'd tensors
+    with torch.device("meta"):
+        model = model_class(config)
+    state_dict = mmap_safetensors(os.path.join(path, "model.safetensors"))
+    if state_dict.keys() == model.state_dict().keys():
+        model.load_state_dict(state_dict, assign=True)
+        return model
+    # Transformers versions that rename checkpoint keys while loading also mmap the file
+    # themselves, so let them do the mapping
+    return model_class.from_pretrained(path, local_files_only=True)
+
+def load_pretrained(model_class, model_name):
+    """Load from the local artifact directory when it exists, otherwise from the hub"""
+    path = get_artifact_dir(model_name)
+    if path is None:
+        return model_class.from_pretrained(model_name)
+    return load_artifact_model(model_class, path)
+
+def get_onnx_path(model_name):
+    """Exported graph path, named after the pinned revision so re-exported artifacts get a new export"""
+    return os.path.join(ONNX_CACHE_DIR, get_pinned_name(model_name).replace("/", "__") + ".onnx")
+
+def export_onnx_model(model_name, model_class, path):
+    """Export a Hugging Face checkpoint to ONNX with a dynamic batch dimension"""
+    model = load_pretrained(model_class, model_name).eval()
+    names = output_names(model_class)
+    dummy = torch.zeros(1, 3, VIT_IMG_SIZE, VIT_IMG_SIZE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Export into a per-process temp directory under the final file name, so a concurrent worker
+    # never loads a half-written model and any external weights file keeps the name the graph
+    # references
+    tmp_dir = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        torch.onnx.export(
+            LogitsOnly(model), (dummy,), os.path.join(tmp_dir, os.path.basename(path)),
+            input_names=["pixel_values"],
+            output_names=names,
+            dynamic_axes={name: {0: "batch"} for name in ["pixel_values"] + names},
+            opset_version=ONNX_OPSET,
+        )
+        # The graph goes last, so it only appears once the weights it points at are in place
+        for name in sorted(os.listdir(tmp_dir), key=lambda name: name == os.path.basename(path)):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(os.path.dirname(path), name))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def create_onnx_session(path):
+    """CPU ONNX Runtime session for an exported graph, with full graph optimizations"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # One session serves every inference worker, so its intra-op pool spans all the cores rather
+    # than one worker's share
+    options.intra_op_num_threads = ONNX_THREADS or CPU_COUNT
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+def load_onnx_model(model_name, model_class):
+    """Load a model through ONNX Runtime, exporting it on first use"""
+    path = get_onnx_path(model_name)
+    if not os.path.exists(path):
+        export_onnx_model(model_name, model_class, path)
+    # Only the label config is needed from the checkpoint once the graph exists
+    config = ViTConfig.from_pretrained(get_artifact_dir(model_name) or model_name)
+    return OnnxViTModel(create_onnx_session(path), config, model_class)
+
+def prepare_vit_model(model):
+    """Put a freshly loaded model in eval mode on DEVICE at the configured precision"""
+    if MODEL_PRECISION not in MODEL_PRECISIONS:
+        raise ValueError(f"Unknown IMAGETRUTH_PRECISION {MODEL_PRECISION!r}, expected one of {MODEL_PRECISIONS}")
+    model.eval()
+    if MODEL_PRECISION == "int8":
+        return quantize_int8(model)
+    if get_model_precision() == "bf16":
+        return AutocastViTModel(model.to(torch.bfloat16))
+    if get_model_precision() == "fp16":
+        # Half the weight memory everywhere, without relying on fast half-precision matmuls
+        # (also what bf16 falls back to without native bf16 kernels)
+        return to_fp16_storage(model)
+    return model.to(DEVICE)
+
+def load_vit_model(model_name, model_class=ViTForImageClassification):
+    """Load a ViT checkpoint on the configured inference backend"""
+    if INFERENCE_BACKEND not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown IMAGETRUTH_BACKEND {INFERENCE_BACKEND!r}, expected one of {INFERENCE_BACKENDS}")
+    if MODEL_COMPILE not in MODEL_COMPILE_MODES:
+        raise ValueError(f"Unknown IMAGETRUTH_COMPILE {MODEL_COMPILE!r}, expected one of {MODEL_COMPILE_MODES}")
+    if INFERENCE_BACKEND == "onnx":
+        if MODEL_PRECISION != "fp32" or MODEL_COMPILE != "none":
+            raise ValueError("IMAGETRUTH_PRECISION and IMAGETRUTH_COMPILE only apply to the torch backend")
+        model = load_onnx_model(model_name, model_class)
+    elif MODEL_PRECISION in ("bf16", "fp16") and MODEL_COMPILE != "none":
+        raise ValueError("IMAGETRUTH_COMPILE can't be combined with bf16 or fp16 precision")
+    else:
+        model = compile_vit_model(prepare_vit_model(load_pretrained(model_class, model_name)))
+    if WARMUP:
+        warmup_vit_model(model)
+    return model
+
+def load_vit_binary_model():
+    """Load the binary classification ViT model from Hugging Face"""
+    return load_vit_model(BINARY_MODEL_NAME)
+
+class LazyModel:
+    """Loads a model on first use, or ahead of time on a background thread"""
+
+    def __init__(self, loader, name):
+        self.name = name
+        self._loader = loader
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def get(self):
+        """Return the model, loading it now (or waiting for a prefetch) if needed"""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._loader()
+        return self._model
+
+    def prefetch(self):
+        """Start loading on a daemon thread; a failed prefetch is retried by the next get()"""
+        with self._thread_lock:
+            if self._model is None and self._thread is None:
+                self._thread = threading.Thread(target=self._prefetch, name=f"prefetch-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _prefetch(self):
+        try:
+            self.get()
+        except Exception:
+            pass
+
+def resolve_model(model):
+    """Unwrap a LazyModel, loading it if this is its first use"""
+    return model.get() if isinstance(model, LazyModel) else model
+
+def load_vit_multiclass_model():
+    """Lazily loaded multiclass classification ViT model from Hugging Face"""
+    return LazyModel(lambda: load_vit_model(MULTICLASS_MODEL_NAME), "multiclass")
+
+def load_vit_shared_model():
+    """Load the shared-trunk ViT model that produces both predictions in one pass"""
+    return load_vit_model(SHARED_MODEL_NAME, ViTForSharedTrunkClassification)
+
+def load_vit_processor():
+    """Load the ViT image processor"""
+    return AutoImageProcessor.from_pretrained(get_artifact_dir(VIT_BASE_MODEL) or VIT_BASE_MODEL)
+
+def load_legacy_binary_model():
+    """Load the legacy Keras CNN; importing it is what pulls in TensorFlow"""
+    from .legacy import LegacyCNNModel
+
+    return LegacyCNNModel.load(LEGACY_MODEL_PATH)
+
+# Binary detectors selectable with IMAGETRUTH_BINARY_BACKEND. Optional ones import their
+# framework inside the loader, so only the selected one is ever imported.
+BINARY_BACKENDS = {
+    "vit": load_vit_binary_model,
+    "legacy_cnn": load_legacy_binary_model,
+}
+
+def load_binary_model():
+    """Load the binary detector selected by IMAGETRUTH_BINARY_BACKEND"""
+    if BINARY_BACKEND not in BINARY_BACKENDS:
+        raise ValueError(f"Unknown IMAGETRUTH_BINARY_BACKEND {BINARY_BACKEND!r}, expected one of {tuple(BINARY_BACKENDS)}")
+    return BINARY_BACKENDS[BINARY_BACKEND]()
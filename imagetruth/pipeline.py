@@ -0,0 +1,240 @@
+"""End-to-end analysis: cache lookups, batched inference and the background model registry
+
+Importing this module is cheap; torch and transformers are imported when the models load.
+"""
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from .batching import MicroBatcher
+from .cache import (
+    get_dhash, get_disk_result_cache, get_image_hash, get_near_dup_index, get_result_cache, lookup_cached_result, singleton,
+)
+from .config import (
+    BATCH_SIZE, BINARY_BACKEND, INFERENCE_QUEUE_SIZE, INFERENCE_QUEUE_TIMEOUT, INFERENCE_THREADS, INFERENCE_WORKERS,
+    MICROBATCH_WINDOW_MS, MODEL_RETRY_COOLDOWN, PREFETCH_GENERATOR, SERVER_URL, SHARED_MODEL_NAME, get_model_revision,
+)
+
+def load_vit_models():
+    """Load the processor and models the app analyzes with"""
+    from .inference import get_vit_transforms
+    from .models import load_binary_model, load_vit_multiclass_model, load_vit_processor, load_vit_shared_model
+
+    if SHARED_MODEL_NAME and BINARY_BACKEND != "vit":
+        raise ValueError("IMAGETRUTH_SHARED_MODEL replaces the binary model and can't be combined with IMAGETRUTH_BINARY_BACKEND")
+    processor = load_vit_processor()
+    if SHARED_MODEL_NAME:
+        # One model serves both stages; analyze_images detects it and runs a single pass
+        binary = multiclass = load_vit_shared_model()
+    else:
+        binary = load_binary_model()
+        # Not loaded until the first AI image (or in the background, with prefetch on)
+        multiclass = load_vit_multiclass_model()
+        if PREFETCH_GENERATOR:
+            multiclass.prefetch()
+    models = SimpleNamespace(processor=processor, transform=get_vit_transforms(processor), binary=binary, multiclass=multiclass)
+    if INFERENCE_WORKERS < 1:
+        raise ValueError(f"IMAGETRUTH_INFERENCE_WORKERS must be at least 1, got {INFERENCE_WORKERS}")
+    models.batcher = MicroBatcher(
+        functools.partial(analyze_items, models), BATCH_SIZE, MICROBATCH_WINDOW_MS / 1000, workers=INFERENCE_WORKERS,
+        max_queued=INFERENCE_QUEUE_SIZE, timeout=INFERENCE_QUEUE_TIMEOUT, init_worker=init_inference_worker,
+    )
+    return models
+
+def init_inference_worker():
+    """Give this worker its share of the cores, so the workers together use each core once"""
+    import torch
+
+    torch.set_num_threads(INFERENCE_THREADS)
+
+class ModelRegistry:
+    """Loads the models on a background thread; work submitted before they are ready waits in order"""
+
+    def __init__(self, loader):
+        self.status = "loading"
+        self.error = None
+        self.models = None
+        self.failed_at = None  # time.monotonic() of the last failed load
+        self._loader = loader
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._start()
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    def analyze(self, derivatives):
+        """Analyze ImageDerivatives, waiting for the models if they are still loading"""
+        return self.submit(analyze_loaded, derivatives).result()
+
+    def retry(self):
+        """Load again if the last attempt failed at least MODEL_RETRY_COOLDOWN seconds ago
+
+        Within the cooldown the error stays up, so callers can show it instead of starting
+        another load (which can take a while with hub retries) on every request.
+        """
+        with self._lock:
+            if self.status != "error" or time.monotonic() - self.failed_at < MODEL_RETRY_COOLDOWN:
+                return
+            self.status, self.error, self.models = "loading", None, None
+            # A fresh queue, so the failed attempt's drain can't pick up work meant for this one
+            self._pending = queue.Queue()
+        self._start()
+
+    def submit(self, fn, *args):
+        """Run fn(models, *args), queued behind earlier work until the models are loaded; returns a Future"""
+        future = Future()
+        self.retry()
+        with self._lock:
+            if self.status == "loading":
+                self._pending.put((fn, args, future))
+                return future
+            models, error = self.models, self.error
+        self._run(fn, args, future, models, error)
+        return future
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._load, name="model-registry", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            models, error = self._loader(), None
+        except Exception as e:
+            models, error = None, e
+        # Flip the status under the lock so nothing is queued after the drain below starts
+        with self._lock:
+            self.models, self.error = models, error
+            self.status = "ready" if error is None else "error"
+            self.failed_at = None if error is None else time.monotonic()
+            pending = self._pending
+        while not pending.empty():
+            self._run(*pending.get(), models, error)
+
+    def _run(self, fn, args, future, models, error):
+        if not future.set_running_or_notify_cancel():
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(f"ViT models failed to load: {error}"))
+            return
+        try:
+            future.set_result(fn(models, *args))
+        except Exception as e:
+            future.set_exception(e)
+
+@singleton
+def get_model_registry():
+    """Process-wide registry, so models start loading once and every session shares them"""
+    return ModelRegistry(load_vit_models)
+
+def get_analyzer():
+    """The inference server client when IMAGETRUTH_SERVER_URL is set, else the in-process registry"""
+    if SERVER_URL:
+        return get_inference_client()
+    return get_model_registry()
+
+@singleton
+def get_inference_client():
+    from .client import InferenceClient
+
+    return InferenceClient(SERVER_URL)
+
+def analyze_image(img, vit_transform, vit_binary_model, vit_multiclass_model):
+    """Analyze an image and return results with generator info if AI"""
+    return analyze_images([img], vit_transform, vit_binary_model, vit_multiclass_model)[0]
+
+def analyze_derivatives(derivatives, vit_transform, vit_binary_model, vit_multiclass_model):
+    """Analyze ImageDerivatives, reusing their memoized model input and image id"""
+    return analyze_images(
+        [d.model_input for d in derivatives], vit_transform, vit_binary_model, vit_multiclass_model,
+        image_hashes=[d.image_id for d in derivatives],
+    )
+
+def analyze_loaded(models, derivatives):
+    """Analyze ImageDerivatives on the inference workers, sharing forward passes with concurrent callers"""
+    from .models import resolve_model
+
+    # The resize to model input happens here, on the caller's thread, not the batcher's
+    items = [(d.model_input, d.image_id) for d in derivatives]
+    results = models.batcher.map(items)
+    pending = [i for i, res in enumerate(results) if res.get("generator_pending")]
+    if pending:
+        # The generator model is still loading: only callers with AI images wait for it, on
+        # their own thread, then run those images again with it loaded
+        resolve_model(models.multiclass)
+        for i, res in zip(pending, models.batcher.map([items[i] for i in pending])):
+            results[i] = res
+    return results
+
+def analyze_items(models, items):
+    """Analyze (model input, image hash) pairs: the micro-batcher's batch function"""
+    images, image_hashes = zip(*items)
+    return analyze_images(
+        list(images), models.transform, models.binary, models.multiclass, image_hashes=list(image_hashes),
+        wait_for_generator=False,
+    )
+
+def analyze_images(
+    images, vit_transform, vit_binary_model, vit_multiclass_model, batch_size=BATCH_SIZE, image_hashes=None,
+    wait_for_generator=True,
+):
+    """Analyze a list of images in batches, returning one result dict per image
+
+    With wait_for_generator=False, AI images analyzed before the generator model has loaded come
+    back marked generator_pending (and uncached) rather than waiting for the load.
+    """
+    from .inference import add_generator_predictions, predict_vit_binary_batch, predict_vit_shared_batch, preprocess_vit_batch
+
+    cache = get_result_cache()
+    disk_cache = get_disk_result_cache()
+    near_dup_index = get_near_dup_index()
+    if image_hashes is None:
+        image_hashes = [get_image_hash(img) for img in images]
+    revision = get_model_revision()
+    keys = [f"{revision}:{image_hash}" for image_hash in image_hashes]
+    results = [lookup_cached_result(key, cache, disk_cache) for key in keys]
+    
+    # Resized or recompressed copies of an analyzed image reuse its verdict
+    dhashes = {}
+    if near_dup_index is not None:
+        for i, res in enumerate(results):
+            if res is None:
+                dhashes[i] = get_dhash(images[i])
+                # The closest match's result may have been evicted while a farther one is still cached
+                for match_key in near_dup_index.find(dhashes[i]):
+                    match = lookup_cached_result(match_key, cache, disk_cache)
+                    if match is not None:
+                        results[i] = dict(match, cache="near-dup")
+                        break
+    
+    # Only images that missed the cache go through the models
+    pending = [i for i, res in enumerate(results) if res is None]
+    for start in range(0, len(pending), batch_size):
+        batch_indices = pending[start:start + batch_size]
+        batch_images = [images[i] for i in batch_indices]
+        pixel_values = preprocess_vit_batch(batch_images, vit_transform)
+        if getattr(vit_binary_model, "is_shared_trunk", False):
+            batch_results = predict_vit_shared_batch(vit_binary_model, pixel_values)
+        elif getattr(vit_binary_model, "takes_images", False):
+            # The legacy CNN preprocesses for itself; pixel_values only feed the generator model
+            batch_results = vit_binary_model.predict_batch(batch_images)
+            add_generator_predictions(batch_results, pixel_values, vit_multiclass_model, wait=wait_for_generator)
+        else:
+            batch_results = predict_vit_binary_batch(vit_binary_model, pixel_values)
+            add_generator_predictions(batch_results, pixel_values, vit_multiclass_model, wait=wait_for_generator)
+        for i, res in zip(batch_indices, batch_results):
+            results[i] = res
+            if res.get("generator_pending"):
+                continue
+            cache.put(keys[i], res)
+            if disk_cache is not None:
+                disk_cache.put(keys[i], res)
+            if i in dhashes:
+                near_dup_index.add(dhashes[i], keys[i])
+    
+    # Hand out copies so callers can't modify the cached entries
+    return [dict(res) for res in results]
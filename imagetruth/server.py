@@ -0,0 +1,124 @@
+"""Standalone inference server: one process owns the models, any number of app processes share it
+
+    python -m imagetruth.server [--host 127.0.0.1] [--port 8765]
+
+Endpoints (JSON over HTTP):
+    GET  /health         {"status": "loading" | "ready" | "error", "error": ..., "pending": ..., "batcher": {...}}
+    POST /analyze        one image item, returns {"result": {...}}
+    POST /analyze_batch  {"images": [item, ...]}, returns {"results": [...]}
+
+An item is {"id": image hash, "size": [width, height], "pixels": base64 raw RGB bytes}, normally
+the 224x224 model input, so the server never decodes uploads. Requests from every client go
+through the same micro-batcher. Once SERVER_MAX_PENDING images are queued new requests get
+503 with Retry-After until the queue drains.
+"""
+import argparse
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from PIL import Image
+
+from .batching import Overloaded
+from .cache import result_to_json
+from .config import SERVER_HOST, SERVER_MAX_PENDING, SERVER_MAX_REQUEST_BYTES, SERVER_PORT
+from .pipeline import get_model_registry
+
+def decode_item(item):
+    """Wire item -> an object with the model_input and image_id that ModelRegistry.analyze reads"""
+    width, height = item["size"]
+    pixels = base64.b64decode(item["pixels"])
+    if len(pixels) != width * height * 3:
+        raise ValueError(f"Expected {width}x{height} RGB pixels, got {len(pixels)} bytes")
+    return SimpleNamespace(model_input=Image.frombytes("RGB", (width, height), pixels), image_id=item["id"])
+
+class InferenceServer(ThreadingHTTPServer):
+    """HTTP front of the model registry with a bound on queued images"""
+    daemon_threads = True
+
+    def __init__(self, address, max_pending=SERVER_MAX_PENDING):
+        super().__init__(address, InferenceHandler)
+        self.registry = get_model_registry()
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def analyze(self, items):
+        """Analyze decoded items, refusing them when the queue is already full"""
+        with self._lock:
+            if self.pending + len(items) > self.max_pending and self.pending > 0:
+                raise Overloaded()
+            self.pending += len(items)
+        try:
+            return self.registry.analyze(items)
+        finally:
+            with self._lock:
+                self.pending -= len(items)
+
+    def health(self):
+        registry = self.registry
+        batcher = registry.models.batcher.stats() if registry.ready else None
+        error = str(registry.error) if registry.error is not None else None
+        return {"status": registry.status, "error": error, "pending": self.pending, "batcher": batcher}
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    server_version = "ImageTruth"
+    protocol_version = "HTTP/1.1"  # Keep-alive, so clients reuse one connection
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        self.send_json(200, self.server.health())
+
+    def do_POST(self):
+        if self.path not in ("/analyze", "/analyze_batch"):
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        length = int(self.headers.get("Content-Length", 0))
+        if length > SERVER_MAX_REQUEST_BYTES:
+            self.close_connection = True
+            return self.send_json(413, {"error": "Request too large"})
+        try:
+            payload = json.loads(self.rfile.read(length))
+            items = [payload] if self.path == "/analyze" else payload["images"]
+            items = [decode_item(item) for item in items]
+        except (KeyError, TypeError, ValueError) as e:
+            return self.send_json(400, {"error": f"Bad request: {e}"})
+        try:
+            results = [result_to_json(res) for res in self.server.analyze(items)]
+        except Overloaded:
+            return self.send_json(503, {"error": "Inference queue is full"}, {"Retry-After": "1"})
+        except Exception as e:
+            return self.send_json(500, {"error": str(e)})
+        self.send_json(200, {"result": results[0]} if self.path == "/analyze" else {"results": results})
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # One line per image would drown everything else
+
+def main():
+    parser = argparse.ArgumentParser(description="ImageTruth inference server")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+    server = InferenceServer((args.host, args.port))
+    print(f"Serving on http://{args.host}:{args.port} (models loading in the background)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
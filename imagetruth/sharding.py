@@ -0,0 +1,107 @@
+"""Multi-process Batch mode: forked workers share the preloaded models copy-on-write
+
+The models are loaded in the app process before the pool forks, so every worker reads the same
+weight pages instead of loading a copy. Files go out in small chunks on the pool's shared task
+queue, so a worker that finishes early takes the next chunk instead of idling behind a fixed
+share. Each result carries its upload index, so callers merge them back in upload order.
+
+libgomp can't run parallel regions in a child forked from a thread that has run OpenMP work
+itself, so the thread that forks never runs torch: the generator is loaded on another thread.
+"""
+import functools
+import io
+import math
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import get_disk_result_cache, get_image_hash, get_near_dup_index, get_result_cache, lookup_cached_result
+from .config import (
+    BATCH_PROCESS_MIN_FILES, BATCH_PROCESSES, BATCH_SIZE, BINARY_BACKEND, CPU_COUNT, INFERENCE_BACKEND,
+    SERVER_URL, get_device, get_model_revision,
+)
+from .images import ImageDerivatives, get_derivatives_cache, open_image
+from .pipeline import analyze_derivatives, get_model_registry
+
+# Set in the parent right before forking; the workers inherit them
+_models = None
+_cached_results = ()  # The parent's in-memory results, so cached images skip the models
+
+def can_shard(count, processes=BATCH_PROCESSES):
+    """Whether a batch of count files should go to worker processes"""
+    # TensorFlow, ONNX Runtime and CUDA don't survive a fork, and a server does its own batching
+    return (
+        processes > 1 and count >= BATCH_PROCESS_MIN_FILES and not SERVER_URL and INFERENCE_BACKEND == "torch"
+        and BINARY_BACKEND == "vit" and "fork" in multiprocessing.get_all_start_methods()
+        and get_device().type == "cpu"
+    )
+
+def prepare_models(models):
+    """Load the generator model too, so the workers share it instead of each loading its own"""
+    from .models import resolve_model
+
+    resolve_model(models.multiclass)
+    return models
+
+def init_worker(threads):
+    import torch
+
+    torch.set_num_threads(threads)
+    # Locks and connections another parent thread held at fork time can't be reused
+    for get_cache in (get_result_cache, get_disk_result_cache, get_near_dup_index, get_derivatives_cache):
+        get_cache.cache_clear()
+    cache = get_result_cache()
+    for key, res in _cached_results:
+        cache.put(key, res)
+
+def analyze_chunk(chunk, preview_size, preview_bytes):
+    """Worker side: decode, analyze and preview (index, file bytes) pairs"""
+    cache = get_result_cache()
+    disk_cache = get_disk_result_cache()
+    revision = get_model_revision()
+    decoded = []
+    out = []
+    for idx, data in chunk:
+        try:
+            img = open_image(io.BytesIO(data))
+            derivatives = ImageDerivatives(img, get_image_hash(img))
+        except Exception as e:
+            out.append((idx, {"error": str(e)}, None, None, False))
+            continue
+        res = lookup_cached_result(f"{revision}:{derivatives.image_id}", cache, disk_cache)
+        if res is not None:
+            out.append((idx, dict(res), derivatives.preview(preview_size, preview_bytes), derivatives.image_id, True))
+        else:
+            decoded.append((idx, derivatives))
+    if decoded:
+        try:
+            results = analyze_derivatives([d for _, d in decoded], _models.transform, _models.binary, _models.multiclass)
+        except Exception as e:
+            results = [{"error": str(e)} for _ in decoded]
+        for (idx, derivatives), res in zip(decoded, results):
+            preview = derivatives.preview(preview_size, preview_bytes) if "error" not in res else None
+            out.append((idx, res, preview, derivatives.image_id, False))
+    return out
+
+def analyze_files(files, preview_size, preview_bytes, processes=BATCH_PROCESSES):
+    """Analyze (index, file bytes) pairs on forked workers, yielding each finished chunk's (index, result, preview)"""
+    global _models, _cached_results
+    # Loading (and warming up) the generator runs OpenMP work, so keep it off this thread
+    with ThreadPoolExecutor(1, thread_name_prefix="shard-prepare") as executor:
+        _models = executor.submit(lambda: get_model_registry().submit(prepare_models).result()).result()
+    cache = get_result_cache()
+    _cached_results = cache.items()
+    # About four chunks per worker, so the last ones to finish are small
+    chunk_size = max(1, min(BATCH_SIZE, math.ceil(len(files) / (processes * 4))))
+    chunks = [files[start:start + chunk_size] for start in range(0, len(files), chunk_size)]
+    run_chunk = functools.partial(analyze_chunk, preview_size=preview_size, preview_bytes=preview_bytes)
+    pool = multiprocessing.get_context("fork").Pool(processes, init_worker, (max(1, CPU_COUNT // processes),))
+    with pool:
+        for chunk_results in pool.imap_unordered(run_chunk, chunks):
+            # The workers' caches die with them; keep the results for reruns in this process
+            for _, res, _, image_hash, cached in chunk_results:
+                key = f"{get_model_revision()}:{image_hash}"
+                if cached:
+                    cache.get(key)  # Count the hit and keep the entry recent
+                elif image_hash is not None and "error" not in res:
+                    cache.put(key, dict(res))
+            yield [(idx, res, preview) for idx, res, preview, _, _ in chunk_results]
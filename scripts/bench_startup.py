@@ -0,0 +1,70 @@
+"""Startup import cost of each inference path, measured in fresh interpreters.
+
+Run from the repository root:
+
+    python scripts/bench_startup.py [--runs 5]
+
+The default (ViT) path must never import TensorFlow; the legacy_cnn row shows what
+selecting IMAGETRUTH_BINARY_BACKEND=legacy_cnn adds on top of it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (modules imported, in order)
+SCENARIOS = {
+    "package (page import)": ["imagetruth"],
+    "vit (default backend)": ["imagetruth", "imagetruth.models", "imagetruth.inference"],
+    "legacy_cnn backend": ["imagetruth", "imagetruth.models", "imagetruth.inference", "imagetruth.legacy"],
+}
+
+PROBE = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+for name in {modules!r}:
+    importlib.import_module(name)
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "tensorflow": "tensorflow" in sys.modules,
+    "torch": "torch" in sys.modules,
+    "streamlit": "streamlit" in sys.modules,
+}}))
+"""
+
+def measure(modules):
+    """Import modules in a fresh interpreter; None if one of them isn't installed"""
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE.format(modules=modules)],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"STARTUP IMPORT COST (median of {args.runs} runs)")
+    print("=" * 60)
+    print(f"{'scenario':<24}{'seconds':>9}{'RSS MB':>9}  imports")
+    for name, modules in SCENARIOS.items():
+        runs = [measure(modules) for _ in range(args.runs)]
+        if any(run is None for run in runs):
+            print(f"{name:<24}{'n/a':>9}{'n/a':>9}  (not installed)")
+            continue
+        seconds = statistics.median(run["seconds"] for run in runs)
+        rss = statistics.median(run["max_rss_mb"] for run in runs)
+        loaded = ", ".join(lib for lib in ("torch", "tensorflow", "streamlit") if runs[0][lib]) or "-"
+        print(f"{name:<24}{seconds:>9.2f}{rss:>9.0f}  {loaded}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Export the app's models into the local artifact layout, pinned to a hub revision.
+
+Run once with network access from the repository root:
+
+    python scripts/export_artifacts.py [--revision main] [--out models/vit]
+
+Each model gets <out>/<org>__<name>/ with model.safetensors, config.json and
+revision.txt (the resolved commit), and the base processor gets its
+preprocessor_config.json. The app then loads everything from there without the
+network, memory-mapping the weights (see IMAGETRUTH_MODEL_DIR).
+"""
+import argparse
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imagetruth.config import BINARY_MODEL_NAME, MODEL_ARTIFACT_DIR, MULTICLASS_MODEL_NAME, SHARED_MODEL_NAME, VIT_BASE_MODEL
+
+def resolve_revision(model_name, revision):
+    """Commit hash a branch or tag points to, so the export is reproducible"""
+    if os.path.isdir(model_name):
+        return "local"
+    from huggingface_hub import HfApi
+
+    return HfApi().model_info(model_name, revision=revision).sha
+
+def export(model_name, revision, out_dir, save):
+    """Write one artifact directory, replacing any previous export atomically"""
+    sha = resolve_revision(model_name, revision)
+    path = os.path.join(out_dir, model_name.replace("/", "__"))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    save(model_name, None if sha == "local" else sha, tmp_path)
+    with open(os.path.join(tmp_path, "revision.txt"), "w") as f:
+        f.write(sha + "\n")
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    print(f"{model_name:<48} {sha[:12]:<12} -> {path}")
+
+def save_model(model_class):
+    def save(model_name, revision, path):
+        model = model_class.from_pretrained(model_name, revision=revision)
+        model.save_pretrained(path)
+        if not os.path.exists(os.path.join(path, "model.safetensors")):
+            raise RuntimeError(f"{model_name} was not saved as a single model.safetensors file")
+    return save
+
+def save_processor(model_name, revision, path):
+    from transformers import AutoConfig, AutoImageProcessor
+
+    AutoImageProcessor.from_pretrained(model_name, revision=revision).save_pretrained(path)
+    AutoConfig.from_pretrained(model_name, revision=revision).save_pretrained(path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--revision", default="main", help="Branch, tag or commit to pin")
+    parser.add_argument("--out", default=MODEL_ARTIFACT_DIR)
+    args = parser.parse_args()
+
+    from transformers import ViTForImageClassification
+    from imagetruth.models import ViTForSharedTrunkClassification
+
+    os.makedirs(args.out, exist_ok=True)
+    export(VIT_BASE_MODEL, args.revision, args.out, save_processor)
+    if SHARED_MODEL_NAME:
+        export(SHARED_MODEL_NAME, args.revision, args.out, save_model(ViTForSharedTrunkClassification))
+    else:
+        export(BINARY_MODEL_NAME, args.revision, args.out, save_model(ViTForImageClassification))
+        export(MULTICLASS_MODEL_NAME, args.revision, args.out, save_model(ViTForImageClassification))
+
+if __name__ == "__main__":
+    main()